@@ -1,77 +1,155 @@
+import errno
+import functools
+import math
 import sys
+import threading
 import time
-from typing import Annotated, Optional
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
+from typing import Annotated, Optional, ParamSpec
 
 import typer
 from rich import print
 
-from pvduck.config import read_config, write_config
-from pvduck.db import (
-    compact_db,
-    create_db,
-    read_log_timestamps,
-    update_from_parquet,
-    update_log,
+from pvduck.config import (
+    Config,
+    config_path,
+    database_path,
+    read_config,
+    write_config,
 )
 from pvduck.project import list_projects, open_database, remove_project
-from pvduck.stream import parquet_from_url
-from pvduck.timeseries import timeseries
 from pvduck.wikimedia import url_from_timestamp
 
+# `pvduck.db` (duckdb) and `pvduck.stream` (pvstream) are imported inside
+# the commands that need them. They are slow to import, and commands like
+# `ls` run on every tab completion.
 app = typer.Typer()
 
+# Statuses meaning the server is overloaded or rate limiting us. Downloads
+# answered with one of these are retried with exponential backoff, and are
+# not logged as failed if they never succeed, so the next sync tries again.
+RETRY_STATUSES = frozenset({429, 503})
+MAX_RETRIES = 4
+
+# Errors writing the temporary files, like a full or missing temporary
+# directory, are not the file's fault either, and are not logged. pvstream
+# raises OSError without an errno for everything it reports, so broken
+# downloads and parse errors are still logged as failed.
+LOCAL_ERRNOS = frozenset({errno.ENOSPC, errno.ENOENT, errno.EACCES})
+
+P = ParamSpec("P")
+
+
+def _require_project(
+    exists: bool = True, database: bool = True
+) -> Callable[[Callable[P, None]], Callable[P, None]]:
+    """Check that a project exists, or doesn't, before running a command.
+    Otherwise, report it and exit with status 2.
+
+    Only the check is guarded. Errors raised by the command itself are not
+    caught, so they are never mistaken for a missing project.
+
+    Args:
+        exists (bool): If True, the project must exist. If False, neither
+            its config nor its database may exist.
+        database (bool): If False, an existing project only needs its
+            config. Editing the config does not touch the database.
+
+    Returns:
+        Callable[[Callable[P, None]], Callable[P, None]]: A decorator for
+            commands taking `project_name` as their first argument.
+    """
+
+    def decorator(fn: Callable[P, None]) -> Callable[P, None]:
+        @functools.wraps(fn)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> None:
+            project_name = kwargs.get(
+                "project_name", args[0] if args else None
+            )
+            config_file = config_path(str(project_name))
+            database_file = database_path(str(project_name))
+            paths = [config_file]
+            if database or not exists:
+                paths.append(database_file)
+
+            if exists and not all(path.is_file() for path in paths):
+                reason = "does not exist"
+            elif not exists and any(path.exists() for path in paths):
+                reason = "already exists"
+            else:
+                fn(*args, **kwargs)
+                return
+
+            print(f"[bold red]Error:[/bold red] '{project_name}' {reason}")
+
+            # `rm --keep-database` leaves a database without a config, which
+            # blocks the name until the file is moved or deleted.
+            if database_file.exists() and not config_file.exists():
+                print(
+                    f"The database of a removed project is left at "
+                    f"'{database_file}'. Move or delete it to reuse the name."
+                )
+            sys.exit(2)
+
+        return wrapper
+
+    return decorator
+
 
 @app.command()
+@_require_project(exists=False)
 def create(project_name: str) -> None:
     """Create a new project."""
-    try:
-        config = write_config(project_name, replace_existing=False)
-        create_db(config.database_path)
-        print(f"Project '{project_name}' created")
-    except FileExistsError:
-        print(f"[bold red]Error:[/bold red] '{project_name}' already exists")
-        sys.exit(2)
+    from pvduck.db import create_db
+
+    config = write_config(project_name, replace_existing=False)
+    create_db(config.database_path)
+    print(f"Project '{project_name}' created")
 
 
 @app.command()
+@_require_project(database=False)
 def edit(
     project_name: Annotated[str, typer.Argument(autocompletion=list_projects)],
 ) -> None:
     """Edit project config."""
-    try:
-        write_config(project_name, replace_existing=True)
-        print(f"Project '{project_name}' updated")
-    except FileNotFoundError:
-        print(f"[bold red]Error:[/bold red] '{project_name}' does not exist")
-        sys.exit(2)
+    write_config(project_name, replace_existing=True)
+    print(f"Project '{project_name}' updated")
 
 
 @app.command()
+@_require_project()
 def open(
     project_name: Annotated[str, typer.Argument(autocompletion=list_projects)],
 ) -> None:
     """Open the database in duckdb."""
-    try:
-        open_database(project_name)
-    except FileNotFoundError:
-        print(f"[bold red]Error:[/bold red] '{project_name}' does not exist")
-        sys.exit(2)
+    open_database(project_name)
 
 
 @app.command()
+@_require_project()
 def rm(
     project_name: Annotated[str, typer.Argument(autocompletion=list_projects)],
+    delete_database: Annotated[
+        bool,
+        typer.Option(
+            "--delete-database/--keep-database",
+            help="Delete the database along with the config",
+        ),
+    ] = True,
 ) -> None:
     """Delete a project, config and database."""
-    try:
-        remove_project(project_name, delete_database=True)
-        print(f"Project '{project_name}' deleted")
-    except FileNotFoundError:
-        print(f"[bold red]Error:[/bold red] '{project_name}' does not exist")
-        sys.exit(2)
+    remove_project(project_name, delete_database=delete_database)
+    print(f"Project '{project_name}' deleted")
 
 
 @app.command()
+@_require_project()
 def sync(
     project_name: Annotated[str, typer.Argument(autocompletion=list_projects)],
     max_files: Annotated[
@@ -80,105 +158,98 @@ def sync(
     ] = None,
 ) -> None:
     """Download, parse, and sync pageviews files."""
-    try:
-        config = read_config(project_name)
-    except FileNotFoundError:
-        print(f"[bold red]Error:[/bold red] '{project_name}' does not exist")
-        sys.exit(2)
+    from pvduck.db import analyze_db, pending_timestamps
+
+    config = read_config(project_name)
+
+    # Work out up front which files are left, so the loop below only ever
+    # sees timestamps that need processing.
+    pending = pending_timestamps(config.database_path, config.timestamps)
+    max_files_reached = bool(max_files and len(pending) > max_files)
+    if max_files_reached:
+        pending = pending[:max_files]
+
+    # Files are downloaded by a pool of worker threads, while the database is
+    # only ever updated from this thread, in batches of files taken in the
+    # order the timestamps were submitted. Never more than
+    # `max_parallel_downloads` files are downloaded at once, as the limit is
+    # there to spare the server. A full batch is only merged after the next
+    # download has been submitted, so the download runs during the merge.
+    parallel = config.max_parallel_downloads
+    throttle = _Throttle(config.sleep_time / parallel)
+    pool = ThreadPoolExecutor(max_workers=parallel)
+    downloads: deque[tuple[datetime, Future[tuple[ExitStack, Path]]]] = deque()
+    parquets: dict[datetime, Path] = {}
 
-    seen = read_log_timestamps(config.database_path)
-    ts = timeseries(config.start_date, config.end_date, config.sample_rate)
-
-    file_count = 0
-    for timestamp in ts:
-        try:
-            if timestamp in seen:
-                continue  # Already processed
-
-            if max_files and file_count >= max_files:
-                print(
-                    "[bold yellow]Max files reached:[/bold yellow] "
-                    f"{max_files}"
-                )
-                break
-
-            file_count += 1
-
-            print(f"Processing '{timestamp}'")
-            url = url_from_timestamp(config.base_url, timestamp)
-
-            print(f"Downloading from '{url}'")
-            with parquet_from_url(
-                url,
-                line_regex=config.line_regex,
-                domain_codes=config.domain_codes,
-                page_title=config.page_title,
-                min_views=config.min_views,
-                max_views=config.max_views,
-                languages=config.languages,
-                domains=config.domains,
-                mobile=config.mobile,
-            ) as parquet:
-                print("Updating database")
-                update_from_parquet(
-                    config.database_path,
-                    parquet,
-                    config.chunk_size,
+    try:
+        # The batch owns the temporary files until they have been merged
+        with ExitStack() as batch:
+            if pending:
+                parallel = _calibrate(
+                    config, pending[0], throttle, pool, batch, parquets
                 )
 
-            update_log(
-                config.database_path,
-                timestamp,
-                success=True,
-            )
-
-            print(f"Sleeping for {config.sleep_time} seconds")
-            time.sleep(config.sleep_time)
-
-        except Exception as e:
-            update_log(
-                config.database_path,
-                timestamp,
-                success=False,
-                error=str(e),
-            )
-            print(f"[bold red]Error:[/bold red] {e}")
+            for timestamp in pending[1:]:
+                print(f"Processing '{timestamp}'")
+                download = pool.submit(_download, config, timestamp, throttle)
+                downloads.append((timestamp, download))
+                if len(parquets) >= config.files_per_batch:
+                    _update(config, batch, parquets)
+                if len(downloads) >= parallel:
+                    _collect(config, *downloads.popleft(), batch, parquets)
+
+            while downloads:
+                if len(parquets) >= config.files_per_batch:
+                    _update(config, batch, parquets)
+                _collect(config, *downloads.popleft(), batch, parquets)
+            _update(config, batch, parquets)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    # Refresh the statistics once, now that all files have been merged
+    if pending:
+        analyze_db(config.database_path)
+
+    if max_files_reached:
+        print(f"[bold yellow]Max files reached:[/bold yellow] {max_files}")
 
     print(f"Project '{project_name}' synced")
 
 
 @app.command()
+@_require_project()
 def status(
     project_name: Annotated[str, typer.Argument(autocompletion=list_projects)],
 ) -> None:
     """See a status overview of the project."""
-    try:
-        config = read_config(project_name)
-    except FileNotFoundError:
-        print(f"[bold red]Error:[/bold red] '{project_name}' does not exist")
-        sys.exit(2)
+    from pvduck.db import count_log_entries
 
-    seen = read_log_timestamps(config.database_path)
-    ts = timeseries(config.start_date, config.end_date, config.sample_rate)
-    errors = read_log_timestamps(config.database_path, success=False)
+    config = read_config(project_name)
 
-    print(
-        f"- Progress: {len(seen)}/{len(ts)} ({len(seen) / len(ts) * 100:.2f}%)"
-    )
-    print(f"- Errors:   {len(errors)}")
+    seen, errors = count_log_entries(config.database_path)
+    total = len(config.timestamps)
+
+    print(f"- Progress: {seen}/{total} ({seen / total * 100:.2f}%)")
+    print(f"- Errors:   {errors}")
 
 
 @app.command()
+@_require_project()
 def compact(
     project_name: Annotated[str, typer.Argument(autocompletion=list_projects)],
+    copy: Annotated[
+        bool,
+        typer.Option(
+            "--copy/--in-place",
+            help="Copy the database to a new file, or rewrite it in place",
+        ),
+    ] = True,
 ) -> None:
     """Compact the database."""
-    try:
-        config = read_config(project_name)
-        compact_db(config.database_path)
-    except FileNotFoundError:
-        print(f"[bold red]Error:[/bold red] '{project_name}' does not exist")
-        sys.exit(2)
+    from pvduck.db import compact_db
+
+    config = read_config(project_name)
+    compact_db(config.database_path, "copy" if copy else "inplace")
 
     print(f"Project '{project_name}' compacted")
 
@@ -188,3 +259,250 @@ def ls() -> None:
     """List all projects."""
     for project_name in list_projects():
         print(f"- {project_name}")
+
+
+class _Throttle:
+    """Enforce a minimum interval between the start of each download."""
+
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._next_start = time.monotonic()
+
+    def backoff(self, delay: float) -> None:
+        """Hold back all downloads for at least `delay` seconds.
+
+        Args:
+            delay (float): Number of seconds to wait.
+        """
+        with self._lock:
+            self._next_start = max(self._next_start, time.monotonic() + delay)
+
+    def wait(self) -> None:
+        """Block until the next download is allowed to start."""
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self._interval
+
+        if delay > 0:
+            print(f"Sleeping for {delay:.0f} seconds")
+            time.sleep(delay)
+
+
+def _download(
+    config: Config, timestamp: datetime, throttle: _Throttle
+) -> tuple[ExitStack, Path]:
+    """Download the pageviews file for a timestamp to a temporary parquet file.
+
+    Runs in a worker thread. The temporary file stays alive until the
+    returned exit stack is closed by the caller.
+
+    Args:
+        config (Config): Configuration of the project.
+        timestamp (datetime): Timestamp of the file to download.
+        throttle (_Throttle): Rate limiter shared between the workers.
+
+    Returns:
+        tuple[ExitStack, Path]: Exit stack owning the temporary file, and
+            the path to the parquet file.
+    """
+    from pvduck.stream import HTTPStatusError, parquet_from_url
+
+    url = url_from_timestamp(config.base_url, timestamp)
+
+    attempt = 0
+    while True:
+        throttle.wait()
+        print(f"Downloading from '{url}'")
+
+        try:
+            with ExitStack() as stack:
+                parquet = stack.enter_context(
+                    parquet_from_url(
+                        url,
+                        batch_size=config.batch_size,
+                        line_regex=config.line_regex,
+                        domain_codes=config.domain_codes,
+                        page_title=config.page_title,
+                        min_views=config.min_views,
+                        max_views=config.max_views,
+                        languages=config.languages,
+                        domains=config.domains,
+                        mobile=config.mobile,
+                        tmp_dir=config.tmp_dir,
+                    )
+                )
+                return stack.pop_all(), parquet
+
+        except HTTPStatusError as e:
+            if e.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                raise
+
+            # Back off all workers, doubling the delay on each attempt
+            attempt += 1
+            delay = max(config.sleep_time, 1) * 2**attempt
+            print(f"Server returned {e.status}, backing off for {delay}s")
+            throttle.backoff(delay)
+
+
+def _calibrate(
+    config: Config,
+    timestamp: datetime,
+    throttle: _Throttle,
+    pool: ThreadPoolExecutor,
+    batch: ExitStack,
+    parquets: dict[datetime, Path],
+) -> int:
+    """Download and merge the first file on its own, and use the timings to
+    decide how many downloads to keep in flight for the rest of the sync.
+
+    When downloading is slower than merging, up to `max_parallel_downloads`
+    files are fetched at once to keep the database busy. When merging is
+    the bottleneck, extra downloads would only pile up on disk.
+
+    Args:
+        config (Config): Configuration of the project.
+        timestamp (datetime): Timestamp of the first file.
+        throttle (_Throttle): Rate limiter shared between the workers.
+        pool (ThreadPoolExecutor): Pool running the downloads.
+        batch (ExitStack): Exit stack owning the files in the batch.
+        parquets (dict[datetime, Path]): The parquet files in the batch.
+
+    Returns:
+        int: The number of downloads to keep in flight.
+    """
+    print(f"Processing '{timestamp}'")
+
+    # `_collect` only adds the file to the batch, so the merge is timed on
+    # its own below, whatever the batch size.
+    start = time.monotonic()
+    download = pool.submit(_download, config, timestamp, throttle)
+    _collect(config, timestamp, download, batch, parquets)
+    downloaded = time.monotonic()
+
+    # Nothing to time if the download failed or was skipped
+    if timestamp not in parquets:
+        return config.max_parallel_downloads
+
+    _update(config, batch, parquets)
+    merged = time.monotonic()
+
+    download_time = downloaded - start
+    merge_time = max(merged - downloaded, 0.001)
+    needed = max(1, math.ceil(download_time / merge_time))
+    parallel = min(config.max_parallel_downloads, needed)
+
+    print(
+        f"Download took {download_time:.1f}s, merge took {merge_time:.1f}s, "
+        f"keeping {parallel} download(s) in flight"
+    )
+    return parallel
+
+
+def _collect(
+    config: Config,
+    timestamp: datetime,
+    download: Future[tuple[ExitStack, Path]],
+    batch: ExitStack,
+    parquets: dict[datetime, Path],
+) -> None:
+    """Wait for a download to finish and add it to the batch. Merging the
+    batch is left to the caller, so it can submit the next download first.
+
+    Args:
+        config (Config): Configuration of the project.
+        timestamp (datetime): Timestamp of the downloaded file.
+        download (Future[tuple[ExitStack, Path]]): The pending download.
+        batch (ExitStack): Exit stack owning the files in the batch.
+        parquets (dict[datetime, Path]): The parquet files in the batch.
+    """
+    from pvduck.stream import HTTPStatusError
+
+    try:
+        stack, parquet = download.result()
+    except Exception as e:
+        # Leave rate limited files and local errors out of the log, so the
+        # next sync retries them
+        if isinstance(e, HTTPStatusError):
+            skip = e.status in RETRY_STATUSES
+        else:
+            skip = isinstance(e, OSError) and e.errno in LOCAL_ERRNOS
+
+        if skip:
+            print(f"[bold yellow]Skipped:[/bold yellow] {e}")
+        else:
+            _log_failure(config, timestamp, e)
+        return
+
+    batch.enter_context(stack)
+    parquets[timestamp] = parquet
+
+
+def _update(
+    config: Config, batch: ExitStack, parquets: dict[datetime, Path]
+) -> None:
+    """Merge a batch of files into the database and release them.
+
+    If the batch fails as a whole, the files are merged one at a time, so
+    only the broken files are logged as failed.
+
+    Args:
+        config (Config): Configuration of the project.
+        batch (ExitStack): Exit stack owning the files in the batch.
+        parquets (dict[datetime, Path]): The parquet files in the batch.
+    """
+    from pvduck.db import update_from_parquets
+
+    if not parquets:
+        return
+
+    for timestamp in parquets:
+        print(f"Updating database with '{timestamp}'")
+
+    try:
+        update_from_parquets(
+            config.database_path,
+            parquets,
+            config.chunk_size,
+            config.merge_strategy,
+        )
+
+    except Exception as e:
+        if len(parquets) == 1:
+            _log_failure(config, next(iter(parquets)), e)
+            return
+
+        for timestamp, parquet in parquets.items():
+            try:
+                update_from_parquets(
+                    config.database_path,
+                    {timestamp: parquet},
+                    config.chunk_size,
+                    config.merge_strategy,
+                )
+            except Exception as e:
+                _log_failure(config, timestamp, e)
+
+    finally:
+        batch.close()
+        parquets.clear()
+
+
+def _log_failure(config: Config, timestamp: datetime, e: Exception) -> None:
+    """Log a file as failed and report the error.
+
+    Args:
+        config (Config): Configuration of the project.
+        timestamp (datetime): Timestamp of the failed file.
+        e (Exception): The error.
+    """
+    from pvduck.db import update_log
+
+    update_log(
+        config.database_path,
+        timestamp,
+        success=False,
+        error=str(e),
+    )
+    print(f"[bold red]Error:[/bold red] {e}")
@@ -1,22 +1,39 @@
 import os
+import pickle
 import shutil
 import subprocess
 import tempfile
+from contextlib import suppress
 from datetime import datetime
+from functools import cached_property
 from pathlib import Path
-from typing import Annotated, Any, Optional
+from typing import Annotated, Any, Literal, Optional, cast
 
 import yaml
-from pydantic import BaseModel, BeforeValidator, Field
-
-from pvduck.validators import mandatory_datetime, optional_datetime
+from pydantic import AfterValidator, BaseModel, BeforeValidator, Field
+
+from pvduck.timeseries import timeseries
+from pvduck.validators import (
+    mandatory_datetime,
+    optional_datetime,
+    writable_directory,
+)
+
+# Use the libyaml bindings when available, they parse several times faster
+# than the pure Python loader.
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore[assignment]
 
 XDG_CONFIG = Path(os.getenv("XDG_CONFIG_HOME", Path.home() / ".config"))
 XDG_DATA = Path(os.getenv("XDG_DATA_HOME", Path.home() / ".local" / "share"))
+XDG_CACHE = Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache"))
 
 ASSETS_ROOT = Path(__file__).parent.parent.parent / "assets"
 CONFIG_ROOT = XDG_CONFIG / "pvduck"
 DATA_ROOT = XDG_DATA / "pvduck"
+CACHE_ROOT = XDG_CACHE / "pvduck"
 
 CONFIG_ROOT.mkdir(parents=True, exist_ok=True)
 DATA_ROOT.mkdir(parents=True, exist_ok=True)
@@ -29,10 +46,12 @@ class Config(BaseModel):
 
     base_url: str
     sleep_time: int
+    max_parallel_downloads: int = Field(default=1, ge=1)
 
     start_date: Annotated[datetime, BeforeValidator(mandatory_datetime)]
     end_date: Annotated[Optional[datetime], BeforeValidator(optional_datetime)]
     sample_rate: float
+    score_version: Literal[1, 2] = 1
 
     line_regex: Optional[str]
     domain_codes: Optional[list[str]]
@@ -48,6 +67,54 @@ class Config(BaseModel):
         description="Number of rows per chunk when updating the database",
         ge=1,
     )
+    # The environment variable is a plain string. Pydantic does not check
+    # the output of a default factory unless asked to with validate_default.
+    merge_strategy: Literal["update", "rebuild"] = Field(
+        default_factory=lambda: cast(
+            Literal["update", "rebuild"],
+            os.getenv("PVDUCK_MERGE_STRATEGY", "update"),
+        ),
+        description="How downloaded files are merged into the database",
+        validate_default=True,
+    )
+    files_per_batch: int = Field(
+        default_factory=lambda: int(os.getenv("PVDUCK_FILES_PER_BATCH", "4")),
+        description="Number of files merged into the database in one go",
+        ge=1,
+        validate_default=True,
+    )
+    batch_size: Optional[int] = Field(
+        default_factory=lambda: (
+            int(size) if (size := os.getenv("PVDUCK_BATCH_SIZE")) else None
+        ),
+        description="Number of rows per row group in the temporary files",
+        ge=1,
+        validate_default=True,
+    )
+    # A directory that can't be written to would fail every download, so
+    # it is checked when the config is loaded instead.
+    tmp_dir: Annotated[Optional[str], AfterValidator(writable_directory)] = (
+        Field(
+            default_factory=lambda: os.getenv("PVDUCK_TMPDIR") or None,
+            description="Directory for temporary parquet files while syncing",
+            validate_default=True,
+        )
+    )
+
+    @cached_property
+    def timestamps(self) -> list[datetime]:
+        """The timestamps of all files selected for the project, computed
+        on first access and reused for the lifetime of the config.
+
+        Returns:
+            list[datetime]: Timestamps in the order they should be synced.
+        """
+        return timeseries(
+            self.start_date,
+            self.end_date,
+            self.sample_rate,
+            score_version=self.score_version,
+        )
 
 
 def read_config(project_name: str) -> Config:
@@ -62,16 +129,68 @@ def read_config(project_name: str) -> Config:
     Raises:
         FileNotFoundError: If the config file does not exist.
     """
-    config_path = CONFIG_ROOT / f"{project_name}.yml"
-    data_path = DATA_ROOT / f"{project_name}.duckdb"
-
-    with open(config_path, "rb") as f:
-        config_data: dict[str, Any] = yaml.safe_load(f)
-        config_data["database_path"] = data_path
+    config_data = _read_yaml_cached(project_name, config_path(project_name))
+    config_data["database_path"] = database_path(project_name)
 
     return Config.model_validate(config_data, strict=True)
 
 
+def _read_yaml_cached(project_name: str, path: Path) -> dict[str, Any]:
+    """Read a YAML config file, using a pickled copy if it hasn't changed.
+
+    Parsing YAML is the most expensive part of reading the config, and the
+    config is read on every invocation of the cli. The parsed content is
+    cached along with the file's modification time and size, and the cache
+    is used for as long as both match the file on disk.
+
+    Only the parsed data is cached, not the validated `Config`, so changes
+    to the model never leave a stale object in the cache.
+
+    Args:
+        project_name (str): Name of the project.
+        path (Path): Path to the YAML config file.
+
+    Returns:
+        dict[str, Any]: The parsed content of the config file.
+
+    Raises:
+        FileNotFoundError: If the config file does not exist.
+    """
+    stat = path.stat()
+    key = (stat.st_mtime_ns, stat.st_size)
+    cache_file = cache_path(project_name)
+
+    try:
+        with open(cache_file, "rb") as f:
+            cached_key, cached_data = pickle.load(f)
+        if cached_key == key:
+            return cached_data
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        pass  # Missing or unreadable cache, fall back to parsing
+
+    with open(path, "rb") as f:
+        config_data: dict[str, Any] = yaml.load(f, Loader=SafeLoader)
+
+    # The cache is only there to save time, so failing to write it must
+    # not fail reading the config. Write to a temporary file first, so
+    # concurrent readers never see a partially written cache.
+    tmp_name = None
+    try:
+        CACHE_ROOT.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=CACHE_ROOT, suffix=".tmp", delete=False
+        ) as f:
+            tmp_name = f.name
+            pickle.dump((key, config_data), f)
+        os.replace(tmp_name, cache_file)
+    except OSError:
+        if tmp_name is not None:
+            with suppress(OSError):
+                os.unlink(tmp_name)
+
+    return config_data
+
+
 def write_config(project_name: str, replace_existing: bool = False) -> Config:
     """Open an editor to let the user modify the config file.
 
@@ -87,24 +206,24 @@ def write_config(project_name: str, replace_existing: bool = False) -> Config:
         FileNotFoundError: If the config file does not exist.
     """
     default_config_path = ASSETS_ROOT / "default_config.yml"
-    project_config_path = CONFIG_ROOT / f"{project_name}.yml"
+    project_config_path = config_path(project_name)
+    config_exists = project_config_path.is_file()
 
-    if project_config_path.is_file() and not replace_existing:
+    if config_exists and not replace_existing:
         raise FileExistsError(
             f"Config file already exists at {project_config_path}"
         )
-    elif not project_config_path.is_file() and replace_existing:
+    elif not config_exists and replace_existing:
         raise FileNotFoundError(
             f"Config file does not exist at {project_config_path}"
         )
 
     # Allow the user to edit a copy of the file in a temporary directory.
-    # If the saved file validates, copy it back to the proper location.
-    with tempfile.TemporaryDirectory() as tmpdir:
+    # If the saved file validates, move it into place. The directory lives
+    # next to the config files, so the move is an atomic rename.
+    with tempfile.TemporaryDirectory(dir=CONFIG_ROOT) as tmpdir:
         src_path = (
-            project_config_path
-            if project_config_path.is_file()
-            else default_config_path
+            project_config_path if config_exists else default_config_path
         )
         tmp_path = Path(tmpdir) / f"{project_name}.yml"
         shutil.copy(src_path, tmp_path)
@@ -115,13 +234,13 @@ def write_config(project_name: str, replace_existing: bool = False) -> Config:
         )
 
         with open(tmp_path, "rb") as f:
-            config_data: dict[str, Any] = yaml.safe_load(f)
-            config_data["database_path"] = DATA_ROOT / f"{project_name}.duckdb"
-            Config.model_validate(config_data, strict=True)
+            config_data: dict[str, Any] = yaml.load(f, Loader=SafeLoader)
+            config_data["database_path"] = database_path(project_name)
+            config = Config.model_validate(config_data, strict=True)
 
-        shutil.copy(tmp_path, project_config_path)
+        os.replace(tmp_path, project_config_path)
 
-    return read_config(project_name)
+    return config
 
 
 def config_path(project_name: str) -> Path:
@@ -146,3 +265,15 @@ def database_path(project_name: str) -> Path:
         Path: Path to the database file.
     """
     return DATA_ROOT / f"{project_name}.duckdb"
+
+
+def cache_path(project_name: str) -> Path:
+    """Get the path to the cached, parsed config file for a project.
+
+    Args:
+        project_name (str): Name of the project.
+
+    Returns:
+        Path: Path to the cache file.
+    """
+    return CACHE_ROOT / f"{project_name}.pkl"
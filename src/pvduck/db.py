@@ -1,12 +1,34 @@
+import atexit
 import logging
+import os
+import threading
+from collections.abc import Generator
+from contextlib import contextmanager, suppress
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional
+from typing import Any, Literal, Optional
 
 import duckdb
 
 logger = logging.getLogger(__name__)
 
+# Open connections, keyed by the path of the database file. The database
+# is only checked for existence when it is first opened. `create_db`
+# drops any connection left behind by a deleted database at the same path.
+_connections: dict[Path, duckdb.DuckDBPyConnection] = {}
+
+# Guards `_connections` and the connections in it. DuckDB allows a single
+# writer per database, and runs each query on all cores by itself, so
+# there is nothing to gain from using a connection from several threads.
+_lock = threading.Lock()
+
+# How parquet files are merged into the pageviews table. See
+# `update_from_parquets` for the trade-offs.
+MergeStrategy = Literal["update", "rebuild"]
+
+# How `compact_db` rewrites the database. See `compact_db` for details.
+CompactMode = Literal["copy", "inplace"]
+
 # The log table is used to keep track of which pageviews files we have
 # already downloaded and merged into the pageviews table.
 LOG_SQL = """
@@ -34,31 +56,107 @@ CREATE TABLE pageviews (
 )
 """
 
-PAGEVIEWS_INDEX_SQL = """
-CREATE UNIQUE INDEX unique_pageviews
-    ON pageviews (domain_code, page_title)
+# CREATE TABLE AS does not copy constraints, so rebuilt tables get the
+# constraints of PAGEVIEWS_SQL back with these. The primary key makes its
+# own columns NOT NULL, and is the only index on the table.
+PAGEVIEWS_CONSTRAINTS_SQL = [
+    "ALTER TABLE pageviews ALTER COLUMN language SET NOT NULL",
+    "ALTER TABLE pageviews ALTER COLUMN domain SET NOT NULL",
+    "ALTER TABLE pageviews ALTER COLUMN mobile SET NOT NULL",
+    "ALTER TABLE pageviews ALTER COLUMN views SET NOT NULL",
+    "ALTER TABLE pageviews ADD PRIMARY KEY (domain_code, page_title)",
+]
+
+# Each chunk of the parquet files is decoded once into a temporary staging
+# table, which the upsert below reads from. Chunks are selected by their
+# row number in each file, which lets duckdb skip the row groups outside
+# the range instead of decoding and discarding them. The same page can
+# appear in several files, so rows are summed per page, leaving at most
+# one row per page in a chunk.
+STAGE_CHUNK = """
+  CREATE OR REPLACE TEMP TABLE staging AS
+  SELECT domain_code,
+         page_title,
+         any_value(language) AS language,
+         any_value(domain) AS domain,
+         any_value(mobile) AS mobile,
+         SUM(views)::UBIGINT AS views
+    FROM read_parquet($files, file_row_number = true)
+   WHERE file_row_number >= $start
+     AND file_row_number < $end
+GROUP BY domain_code, page_title
 """
 
 # Add views from a parquet file to the table, or create new rows if they
 # don't exist yet. This design is created to save space, but note that it
 # is destructive, so we need to keep track of which files we have inserted.
-UPDATE_PAGEVIEWS = """
-UPDATE pageviews
-   SET views = pageviews.views + p.views
-  FROM ({chunk_query}) AS p
- WHERE pageviews.domain_code = p.domain_code
-   AND pageviews.page_title = p.page_title
-"""
-
-INSERT_PAGEVIEWS = """
+# A single upsert looks up each staged page in the primary key index once,
+# where a separate UPDATE and INSERT would join the tables twice. It fails
+# if a page appears twice in the staging table, which is why the staging
+# table is grouped by page.
+UPSERT_PAGEVIEWS = """
 INSERT INTO pageviews
     (domain_code, language, domain, mobile, page_title, views)
-   SELECT p.domain_code, p.language, p.domain, p.mobile, p.page_title, p.views
-     FROM ({chunk_query}) AS p
-LEFT JOIN pageviews AS v
-       ON v.domain_code = p.domain_code
-      AND v.page_title = p.page_title
-    WHERE v.domain_code IS NULL
+SELECT domain_code, language, domain, mobile, page_title, views
+  FROM staging
+    ON CONFLICT (domain_code, page_title)
+    DO UPDATE SET views = pageviews.views + EXCLUDED.views
+"""
+
+# Alternative to the upsert above: build a new pageviews table by summing
+# the old one together with the parquet files. This is a single parallel
+# aggregation, while the upsert runs on one thread.
+REBUILD_PAGEVIEWS = """
+  SELECT domain_code,
+         any_value(language) AS language,
+         any_value(domain) AS domain,
+         any_value(mobile) AS mobile,
+         page_title,
+         SUM(views)::UBIGINT AS views
+    FROM (
+          SELECT domain_code, language, domain, mobile, page_title, views
+            FROM pageviews
+       UNION ALL
+          SELECT domain_code, language, domain, mobile, page_title, views
+            FROM read_parquet($files)
+         )
+GROUP BY domain_code, page_title
+"""
+
+# Copy of the pageviews table, used to compact it. Columns are listed so
+# the new table always gets the schema's column order. DuckDB stores rows
+# in the order they are inserted, so sorting the copy clusters each domain
+# code in as few row groups as possible, and the min/max zonemaps can skip
+# the rest when a query filters on domain code.
+COMPACT_PAGEVIEWS = """
+  SELECT domain_code, language, domain, mobile, page_title, views
+    FROM pageviews
+ORDER BY domain_code, page_title
+"""
+
+# Return the candidate timestamps that have no entry in the log, keeping
+# the order they were given in. The order matters, as the time series is
+# ranked to make sampling stable.
+PENDING_TIMESTAMPS = """
+    SELECT c.timestamp
+      FROM unnest(?::TIMESTAMP[]) WITH ORDINALITY AS c(timestamp, position)
+ANTI JOIN log
+       ON log.timestamp = c.timestamp
+ ORDER BY c.position
+"""
+
+# Log a batch of timestamps as successfully merged. This runs in the same
+# transaction as the merge, as one statement for the whole batch.
+INSERT_LOG_SUCCESS = """
+INSERT INTO log (timestamp, success)
+SELECT unnest(?::TIMESTAMP[]), true
+"""
+
+# Log the outcome of a single file. Only used for failures in `sync`, which
+# are rare and written as they happen.
+INSERT_LOG = """
+INSERT INTO log (timestamp, success, error)
+VALUES (?, ?, ?)
 """
 
 
@@ -74,35 +172,98 @@ def create_db(db: Path) -> None:
     if db.exists():
         raise FileExistsError(f"Database already exists at {db}")
 
+    with _lock:
+        stale = _connections.pop(db, None)
+        if stale is not None:
+            stale.close()
+
     # Create the database and tables
     with duckdb.connect(db) as connection:
-        connection.sql("BEGIN TRANSACTION")
+        connection.begin()
         connection.sql(LOG_SQL)
         connection.sql(PAGEVIEWS_SQL)
-        connection.sql(PAGEVIEWS_INDEX_SQL)
-        connection.sql("COMMIT TRANSACTION")
+        connection.commit()
 
 
 def read_log_timestamps(
     db: Path, success: Optional[bool] = None
 ) -> set[datetime]:
-    """Get a list of all the files we have already processed."""
-    if not db.is_file():
-        raise FileNotFoundError(f"Database does not exist at {db}")
+    """Get a list of all the files we have already processed.
 
+    This loads the whole log into Python. `sync` and `status` use
+    `pending_timestamps` and `count_log_entries` instead, which let duckdb
+    do the work.
+
+    Args:
+        db (Path): The path to the database file.
+        success (Optional[bool]): If set, only return the files that
+            succeeded (True) or failed (False).
+
+    Returns:
+        set[datetime]: The timestamps of the processed files.
+
+    Raises:
+        FileNotFoundError: If the database file does not exist.
+    """
     sql = "SELECT timestamp FROM log "
     if success is True:
         sql += "WHERE success"
     elif success is False:
         sql += "WHERE NOT success"
 
-    with duckdb.connect(db) as connection:
+    with _connect(db) as connection:
         result = connection.sql(sql).fetchall()
         return {row[0] for row in result}
 
 
+def pending_timestamps(db: Path, candidates: list[datetime]) -> list[datetime]:
+    """Get the candidate timestamps we have not processed yet.
+
+    The set difference is computed by duckdb, so the log never has to be
+    loaded into Python. Failed files count as processed, just like in the
+    log itself.
+
+    Args:
+        db (Path): The path to the database file.
+        candidates (list[datetime]): The timestamps to check.
+
+    Returns:
+        list[datetime]: The timestamps missing from the log, in the same
+            order as `candidates`.
+
+    Raises:
+        FileNotFoundError: If the database file does not exist.
+    """
+    with _connect(db) as connection:
+        result = connection.execute(PENDING_TIMESTAMPS, [candidates])
+        return [row[0] for row in result.fetchall()]
+
+
+def count_log_entries(db: Path) -> tuple[int, int]:
+    """Count the files we have processed, and how many of them failed.
+
+    Args:
+        db (Path): The path to the database file.
+
+    Returns:
+        tuple[int, int]: The number of processed files, and the number of
+            files that failed.
+
+    Raises:
+        FileNotFoundError: If the database file does not exist.
+    """
+    sql = "SELECT COUNT(*), COUNT(*) FILTER (WHERE NOT success) FROM log"
+
+    with _connect(db) as connection:
+        result = connection.sql(sql).fetchone()
+        return (result[0], result[1]) if result else (0, 0)
+
+
 def update_from_parquet(
-    db: Path, parquet: Path, chunk_size: int = 1_000_000
+    db: Path,
+    parquet: Path,
+    chunk_size: int = 1_000_000,
+    strategy: MergeStrategy = "update",
 ) -> None:
     """Update the database with the content of the parquet file.
 
@@ -113,32 +274,121 @@ def update_from_parquet(
     Args:
         db (Path): The path to the database file.
         parquet (Path): The path to the parquet file.
-        chunk_size (int): The number of rows to UPDATE/INSERT in one go.
+        chunk_size (int): The number of rows to upsert in one go.
             Lower to save memory, increase for faster execution times.
+        strategy (MergeStrategy): How to merge the file into the table.
+            See `update_from_parquets`.
 
     Raises:
         FileNotFoundError: If either file does not exist.
     """
-    if not db.is_file():
-        raise FileNotFoundError(f"Database does not exist at {db}")
     if not parquet.is_file():
         raise FileNotFoundError(f"Parquet file does not exist at {parquet}")
 
-    with duckdb.connect(db) as connection:
-        result = connection.execute(
-            f"SELECT COUNT(*) FROM read_parquet('{parquet}')"
-        ).fetchone()
-        parquet_row_count = result[0] if result else 0
-
-        for offset in range(0, parquet_row_count, chunk_size):
-            cq = f"""
-                SELECT *
-                  FROM read_parquet('{parquet}')
-                 LIMIT {chunk_size}
-                OFFSET {offset}
-            """
-            connection.execute(UPDATE_PAGEVIEWS.format(chunk_query=cq))
-            connection.execute(INSERT_PAGEVIEWS.format(chunk_query=cq))
+    with _connect(db) as connection:
+        connection.begin()
+        _merge_parquets(connection, [parquet], chunk_size, strategy)
+        connection.commit()
+
+
+def update_from_parquets(
+    db: Path,
+    parquets: dict[datetime, Path],
+    chunk_size: int = 1_000_000,
+    strategy: MergeStrategy = "update",
+) -> None:
+    """Update the database with the content of several parquet files, and
+    log them as successful.
+
+    All files are read in the same queries, so the join against the
+    pageviews table is done once per batch rather than once per file. It
+    all happens in one transaction, so if anything fails, nothing is
+    merged or logged, and the pageviews and the log can never disagree.
+
+    There are two ways to merge the files:
+
+    - `update` updates existing rows and inserts new ones, in chunks of
+      `chunk_size` rows. Memory use is bounded, but duckdb runs UPDATE on
+      a single thread.
+    - `rebuild` replaces the table with one aggregated from the old table
+      and the files, using all cores. It ignores `chunk_size`, needs disk
+      space for a second copy of the table, and leaves it compacted. It
+      pays off when batches are large compared to the table.
+
+    Args:
+        db (Path): The path to the database file.
+        parquets (dict[datetime, Path]): The parquet file for each timestamp.
+        chunk_size (int): The number of rows to upsert in one go.
+            Lower to save memory, increase for faster execution times.
+        strategy (MergeStrategy): How to merge the files into the table.
+
+    Raises:
+        FileNotFoundError: If the database or any parquet file does not
+            exist.
+    """
+    for parquet in parquets.values():
+        if not parquet.is_file():
+            raise FileNotFoundError(
+                f"Parquet file does not exist at {parquet}"
+            )
+
+    with _connect(db) as connection:
+        connection.begin()
+        _merge_parquets(
+            connection, list(parquets.values()), chunk_size, strategy
+        )
+        connection.execute(INSERT_LOG_SUCCESS, [list(parquets)])
+        connection.commit()
+
+
+def _merge_parquets(
+    connection: duckdb.DuckDBPyConnection,
+    parquets: list[Path],
+    chunk_size: int,
+    strategy: MergeStrategy,
+) -> None:
+    """Add the views in parquet files to the pageviews table.
+
+    With the `update` strategy, each chunk is read from all the files at
+    once, into a staging table which is used to update existing rows and
+    insert new ones. A chunk holds up to `chunk_size` rows in total, split
+    evenly between the files. The files are opened once per chunk, so the
+    connection should have `parquet_metadata_cache` enabled.
+
+    Args:
+        connection (duckdb.DuckDBPyConnection): Connection to the database.
+        parquets (list[Path]): The paths to the parquet files.
+        chunk_size (int): The number of rows to upsert in one go.
+        strategy (MergeStrategy): How to merge the files into the table.
+
+    Raises:
+        ValueError: If the strategy is unknown.
+    """
+    # Paths are passed as parameters, so duckdb can cache the statements'
+    # plans and odd characters in a path can't break the SQL.
+    files = [str(parquet) for parquet in parquets]
+
+    if strategy == "rebuild":
+        _rebuild_pageviews(connection, REBUILD_PAGEVIEWS, {"files": files})
+        return
+    elif strategy != "update":
+        raise ValueError(f"Unknown merge strategy: {strategy}")
+
+    rows_per_file = max(1, chunk_size // len(parquets))
+
+    result = connection.execute(
+        "SELECT MAX(num_rows) FROM parquet_file_metadata(?)", [files]
+    ).fetchone()
+    max_row_count = result[0] if result and result[0] else 0
+
+    for start in range(0, max_row_count, rows_per_file):
+        connection.execute(
+            STAGE_CHUNK,
+            {"files": files, "start": start, "end": start + rows_per_file},
+        )
+        connection.execute(UPSERT_PAGEVIEWS)
+
+    connection.execute("DROP TABLE IF EXISTS staging")
 
 
 def update_log(
@@ -152,92 +402,228 @@ def update_log(
         success (bool): Whether the operation was successful.
         error (Optional[str]): The error message if the operation failed.
     """
-    if not db.is_file():
-        raise FileNotFoundError(f"Database does not exist at {db}")
-
     # If this is a very recent file, we'll assume it's not available
     # yet and proceed instead of failing.
     if success is False and datetime.now() - timestamp < timedelta(hours=12):
-        print("File not available yet, skipping")
+        logger.debug("File %s not available yet, skipping", timestamp)
         return
 
-    with duckdb.connect(db) as connection:
-        connection.execute(
-            "INSERT INTO log (timestamp, success, error) VALUES (?, ?, ?)",
-            (timestamp, success, error),
-        )
+    with _connect(db) as connection:
+        connection.execute(INSERT_LOG, (timestamp, success, error))
+
+
+def analyze_db(db: Path) -> None:
+    """Refresh the statistics DuckDB uses to plan queries on the database.
+
+    DuckDB estimates the number of distinct values in each column as rows
+    are inserted, but the estimates are not updated when existing rows are
+    updated, so they drift as views are added to existing pages. Stale
+    estimates can lead to poor join orders in queries on the database.
+
+    Analyzing reads the whole database, so it should be done once after a
+    sync, not after every merge.
 
+    Args:
+        db (Path): The path to the database file.
+
+    Raises:
+        FileNotFoundError: If the database file does not exist.
+    """
+    with _connect(db) as connection:
+        connection.execute("ANALYZE")
 
-def compact_db(db: Path) -> tuple[float, float, float]:
-    """Compact the database by creating a new table and dropping the old one.
+
+def compact_db(db: Path, mode: CompactMode = "copy") -> tuple[int, int, int]:
+    """Compact the database by rewriting the pageviews table from scratch.
 
     DuckDB does not automatically compact the database when upserting data,
-    which can lead to fragmentation and increased file size. This function
-    creates a new table with the same schema as the original, copies the
-    data from the original table to the new table, and then drops the
-    original table.
+    which can lead to fragmentation and increased file size.
+
+    With the `copy` mode, the database is copied into a new file, which
+    then replaces the original. The new file holds nothing but live data,
+    with the pageviews table sorted by its key. This is what the DuckDB
+    documentation recommends for reclaiming space.
 
-    This requires enough disk space to create a new copy of the table, so it
-    is not run automatically.
+    With the `inplace` mode, the pageviews table is replaced by a sorted
+    copy within the same file. This defragments the table, but the blocks
+    of the old table are only marked as free, so the file itself rarely
+    shrinks.
 
-    This may be improved in the future, keep an eye on:
-    https://duckdb.org/docs/stable/operations_manual/footprint_of_duckdb/reclaiming_space.html
+    Both modes need enough disk space for a second copy of the table, so
+    compacting is not run automatically.
 
     Args:
         db (Path): The path to the database file.
+        mode (CompactMode): How to rewrite the database.
 
     Raises:
         FileNotFoundError: If the database file does not exist.
+        ValueError: If the mode is unknown.
 
     Returns:
-        tuple[float, float, float]: The size of the database before and after
-            compacting, and the space saved.
+        tuple[int, int, int]: The size of the database in bytes before and
+            after compacting, and the space saved.
     """
-    if not db.is_file():
-        raise FileNotFoundError(f"Database does not exist at {db}")
+    if mode not in ("copy", "inplace"):
+        raise ValueError(f"Unknown compact mode: {mode}")
 
-    size_pre_compacting = _file_size_mb(db)
-    logger.info("Compacting database %s", db)
-    logger.info("Size before compacting: %.2f MB", size_pre_compacting)
+    compacted = db.with_name(f"{db.name}.compacted")
 
-    with duckdb.connect(db) as connection:
-        connection.sql("BEGIN TRANSACTION")
-        connection.sql(
-            """
-            CREATE TABLE pageviews_compacted AS
-            SELECT * FROM pageviews
-            """
+    with _connect(db) as connection:
+        # The connection stays open, so write everything to the database
+        # file before measuring it.
+        connection.sql("CHECKPOINT")
+
+        size_pre_compacting = db.stat().st_size
+        logger.info("Compacting database %s", db)
+        logger.info(
+            "Size before compacting: %.2f MB", size_pre_compacting / 2**20
+        )
+
+        if mode == "copy":
+            _copy_database(connection, compacted)
+
+            # The connection still points to the old file, so it is closed
+            # and dropped before the file is replaced.
+            _connections.pop(db).close()
+            os.replace(compacted, db)
+        else:
+            connection.begin()
+            _rebuild_pageviews(connection, COMPACT_PAGEVIEWS)
+            connection.commit()
+
+            # Release the old table's blocks before measuring again
+            connection.sql("CHECKPOINT")
+            connection.sql("VACUUM")
+
+    size_post_compacting = db.stat().st_size
+    space_saved = size_pre_compacting - size_post_compacting
+    logger.info("Size after compacting: %.2f MB", size_post_compacting / 2**20)
+    logger.info("Space saved: %.2f MB", space_saved / 2**20)
+
+    return size_pre_compacting, size_post_compacting, space_saved
+
+
+def _copy_database(
+    connection: duckdb.DuckDBPyConnection, target: Path
+) -> None:
+    """Copy the database into a new database file.
+
+    The schema is copied as is, except for the pageviews table, which is
+    created from scratch. Its rows are inserted sorted by its key. Any
+    existing file at the target path, like one left behind by an
+    interrupted copy, is overwritten.
+
+    Args:
+        connection (duckdb.DuckDBPyConnection): Connection to the database.
+        target (Path): The path to the new database file.
+    """
+    target.unlink(missing_ok=True)
+
+    # Neither identifiers nor the path to ATTACH can be passed as
+    # parameters, so they are quoted instead.
+    source = connection.sql("SELECT current_database()").fetchall()[0][0]
+    source = '"{}"'.format(source.replace('"', '""'))
+    path = "'{}'".format(str(target).replace("'", "''"))
+
+    connection.execute(f"ATTACH {path} AS compacted")
+    try:
+        connection.execute(
+            f"COPY FROM DATABASE {source} TO compacted (SCHEMA)"
         )
-        connection.sql("DROP TABLE pageviews")
-        connection.sql(
-            """
-            ALTER TABLE pageviews_compacted
-            RENAME TO pageviews
-            """
+        # Older databases have a `unique_pageviews` index duplicating the
+        # primary key, or only that index and no constraints at all if an
+        # older version compacted them. The pageviews table is created from
+        # PAGEVIEWS_SQL instead, from a cursor so the connection keeps its
+        # own default database.
+        with connection.cursor() as cursor:
+            cursor.execute("USE compacted")
+            cursor.execute("DROP TABLE pageviews")
+            cursor.execute(PAGEVIEWS_SQL)
+        connection.execute("INSERT INTO compacted.log SELECT * FROM log")
+        connection.execute(
+            f"INSERT INTO compacted.pageviews {COMPACT_PAGEVIEWS}"
         )
-        connection.sql(PAGEVIEWS_INDEX_SQL)
-        connection.sql("COMMIT TRANSACTION")
+    finally:
+        connection.execute("DETACH compacted")
 
-    size_post_compacting = _file_size_mb(db)
-    logger.info("Size after compacting: %.2f MB", size_post_compacting)
-    logger.info(
-        "Space saved: %.2f MB", size_pre_compacting - size_post_compacting
-    )
 
-    return (
-        size_pre_compacting,
-        size_post_compacting,
-        size_pre_compacting - size_post_compacting,
+def _rebuild_pageviews(
+    connection: duckdb.DuckDBPyConnection,
+    query: str,
+    parameters: Optional[dict[str, Any]] = None,
+) -> None:
+    """Replace the pageviews table with the result of a query.
+
+    The new table is written from scratch, so it has no fragmentation
+    left from earlier updates. Both tables exist until the old one is
+    replaced, which needs disk space for a second copy. Indexes on the old
+    table, like the redundant `unique_pageviews` index older databases
+    were created with, are dropped along with it. The new table gets the
+    constraints of `PAGEVIEWS_SQL` back, including the primary key.
+
+    Args:
+        connection (duckdb.DuckDBPyConnection): Connection to the database.
+        query (str): Query returning the rows of the new table, with the
+            same columns as the pageviews table.
+        parameters (Optional[dict[str, Any]]): Named parameters for the
+            query.
+    """
+    connection.execute(
+        f"CREATE OR REPLACE TABLE pageviews AS {query}", parameters
     )
+    for statement in PAGEVIEWS_CONSTRAINTS_SQL:
+        connection.execute(statement)
+
 
+@contextmanager
+def _connect(db: Path) -> Generator[duckdb.DuckDBPyConnection, None, None]:
+    """Borrow a connection to the database, opening it on first use.
 
-def _file_size_mb(path: Path) -> float:
-    """Return the size of the file in MB.
+    Opening a database means loading its catalog, which costs more than
+    most of the queries we run. Connections are therefore kept open for the
+    lifetime of the process and closed on exit. If the borrower fails, any
+    open transaction is rolled back before the connection is reused.
+
+    Connections are not thread safe, so only one thread can borrow a
+    connection at a time. Other threads block until it is returned.
 
     Args:
-        path (Path): The path to the file.
+        db (Path): The path to the database file.
 
-    Returns:
-        float: The size of the file in MB.
+    Yields:
+        duckdb.DuckDBPyConnection: The connection to the database.
+
+    Raises:
+        FileNotFoundError: If the database file does not exist.
     """
-    return path.stat().st_size / (1024 * 1024)
+    with _lock:
+        connection = _connections.get(db)
+        if connection is None:
+            if not db.is_file():
+                raise FileNotFoundError(f"Database does not exist at {db}")
+
+            connection = duckdb.connect(db)
+            # Merging reads each parquet file several times. Caching the
+            # parsed footer saves decoding the file metadata on every read.
+            connection.execute("SET parquet_metadata_cache = true")
+            # No query relies on the order rows are stored in, and dropping
+            # the guarantee lets duckdb insert and aggregate in parallel
+            # with less memory.
+            connection.execute("SET preserve_insertion_order = false")
+            _connections[db] = connection
+
+        try:
+            yield connection
+        except BaseException:
+            with suppress(duckdb.Error):
+                connection.rollback()
+            raise
+
+
+@atexit.register
+def _close_connections() -> None:
+    """Close all open connections, checkpointing their databases."""
+    while _connections:
+        _, connection = _connections.popitem()
+        connection.close()
@@ -1,10 +1,14 @@
+import os
+import shutil
 import subprocess
+from contextlib import suppress
 from dataclasses import dataclass
+from pathlib import Path
 
 from pvduck import config
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ProjectStatus:
     """Status of a project."""
 
@@ -12,6 +16,9 @@ class ProjectStatus:
 def open_database(project_name: str) -> None:
     """Open the database in DuckDB.
 
+    The `duckdb` CLI is used if it is installed. Otherwise, a minimal shell
+    is run with the `duckdb` Python package, which is always available.
+
     Args:
         project_name (str): Name of the project.
     """
@@ -20,12 +27,60 @@ def open_database(project_name: str) -> None:
     if not db_path.is_file():
         raise FileNotFoundError(f"Database does not exist at {db_path}")
 
+    if shutil.which("duckdb") is None:
+        _run_shell(db_path)
+        return
+
     subprocess.run(
         ["duckdb", str(db_path)],
         check=True,
     )
 
 
+def _run_shell(db_path: Path) -> None:
+    """Run SQL statements typed by the user against the database.
+
+    Each line is run as a statement and its result printed, until the user
+    ends the input with Ctrl-D. Ctrl-C cancels the current line or query.
+
+    Args:
+        db_path (Path): The path to the database file.
+    """
+    import duckdb
+
+    # Enables line editing and history in `input` where available
+    with suppress(ImportError):
+        import readline  # noqa: F401
+
+    print("duckdb CLI not found, using a minimal shell. Ctrl-D to exit.")
+
+    with duckdb.connect(db_path) as connection:
+        while True:
+            try:
+                line = input("D ")
+            except EOFError:
+                print()
+                break
+            except KeyboardInterrupt:
+                # Ctrl-C cancels the current line, like in the duckdb CLI
+                print()
+                continue
+
+            if not line.strip():
+                continue
+
+            # Most errors are only raised when the result is fetched, so
+            # showing it is guarded too.
+            try:
+                result = connection.sql(line)
+                if result is not None:
+                    result.show()
+            except duckdb.Error as e:
+                print(f"Error: {e}")
+            except KeyboardInterrupt:
+                print()
+
+
 def remove_project(project_name: str, delete_database: bool = False) -> None:
     """Delete the config file for a project.
 
@@ -44,10 +99,13 @@ def remove_project(project_name: str, delete_database: bool = False) -> None:
     if not config_path.is_file() or not database_path.is_file():
         raise FileNotFoundError(f"Project {project_name} does not exist")
 
-    if config_path.is_file():
-        config_path.unlink()
-    if database_path.is_file() and delete_database:
-        database_path.unlink()
+    # Both files were just checked, so don't check again before deleting,
+    # and tolerate them disappearing in the meantime.
+    config_path.unlink(missing_ok=True)
+    if delete_database:
+        database_path.unlink(missing_ok=True)
+
+    config.cache_path(project_name).unlink(missing_ok=True)
 
 
 def list_projects() -> list[str]:
@@ -56,4 +114,11 @@ def list_projects() -> list[str]:
     Returns:
         list[str]: List of project names.
     """
-    return [f.stem for f in config.CONFIG_ROOT.glob("*.yml")]
+    # `ls` and tab completion call this often. `os.scandir` gets the file
+    # type from the directory listing, without a `Path` or glob per entry.
+    with os.scandir(config.CONFIG_ROOT) as entries:
+        return [
+            entry.name.removesuffix(".yml")
+            for entry in entries
+            if entry.name.endswith(".yml") and entry.is_file()
+        ]
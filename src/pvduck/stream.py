@@ -1,3 +1,4 @@
+import re
 import tempfile
 from collections.abc import Generator
 from contextlib import contextmanager
@@ -6,6 +7,19 @@ from typing import Optional
 
 import pvstream
 
+# `pvstream` reports HTTP errors as plain `IOError`s, with the message from
+# the Rust `reqwest` crate, e.g. "HTTP status client error (429 Too Many
+# Requests) for url (...)". The status code is the only structured part.
+HTTP_STATUS_RE = re.compile(r"HTTP status (?:client|server) error \((\d{3})")
+
+
+class HTTPStatusError(OSError):
+    """The server answered a download request with an error status."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
 
 @contextmanager
 def parquet_from_file(
@@ -19,6 +33,7 @@ def parquet_from_file(
     languages: Optional[list[str]] = None,
     domains: Optional[list[str]] = None,
     mobile: Optional[bool] = None,
+    tmp_dir: Optional[str] = None,
 ) -> Generator[Path, None, None]:
     """Stream a file from the local file system and store it in a temporary
     parquet file which is deleted when the context manager closes.
@@ -35,6 +50,8 @@ def parquet_from_file(
             to use more memory and speed up the process, or lower to use less
             memory at longer run times.
         line_regex (Optional[str]): A regex to filter the lines in the file.
+            It is compiled by the Rust `regex` crate, which matches in
+            linear time, so it is passed on as a string.
         domain_codes (Optional[list[str]]): A list of domain codes to filter
             the lines in the file. For example, `["en", "de.m"]` will include
             only lines from the English desktop and German mobile Wikipedia.
@@ -51,11 +68,15 @@ def parquet_from_file(
         mobile (Optional[bool]): Whether to include mobile views. If True,
             only mobile views will be included. If False, only desktop views
             will be included.
+        tmp_dir (Optional[str]): The directory to create the temporary
+            parquet file in. Defaults to the system's temporary directory.
+            Point it to a memory backed file system (like `/dev/shm`) to
+            avoid writing the file to disk.
 
     Yields:
         Path: The path to the parquet file.
     """
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmpdir:
         fn = path.name
         target_path = Path(tmpdir) / fn.replace(".gz", ".parquet")
 
@@ -88,6 +109,7 @@ def parquet_from_url(
     languages: Optional[list[str]] = None,
     domains: Optional[list[str]] = None,
     mobile: Optional[bool] = None,
+    tmp_dir: Optional[str] = None,
 ) -> Generator[Path, None, None]:
     """Stream a file from the remote server and store it in a temporary parquet
     file which is deleted when the context manager closes.
@@ -97,6 +119,10 @@ def parquet_from_url(
     a parquet file. We just need the parquet file long enough to load it into
     the database.
 
+    The HTTP request is made by `pvstream` on the Rust side, which does not
+    accept a client or session from Python. Connection reuse between files
+    therefore has to be implemented in `pvstream` itself.
+
     Args:
         url (str): The URL of the file to stream.
         batch_size (Optional[int]): The number of rows to process at a time.
@@ -104,6 +130,8 @@ def parquet_from_url(
             to use more memory and speed up the process, or lower to use less
             memory at longer run times.
         line_regex (Optional[str]): A regex to filter the lines in the file.
+            It is compiled by the Rust `regex` crate, which matches in
+            linear time, so it is passed on as a string.
         domain_codes (Optional[list[str]]): A list of domain codes to filter
             the lines in the file. For example, `["en", "de.m"]` will include
             only lines from the English desktop and German mobile Wikipedia.
@@ -120,26 +148,39 @@ def parquet_from_url(
         mobile (Optional[bool]): Whether to include mobile views. If True,
             only mobile views will be included. If False, only desktop views
             will be included.
+        tmp_dir (Optional[str]): The directory to create the temporary
+            parquet file in. Defaults to the system's temporary directory.
+            Point it to a memory backed file system (like `/dev/shm`) to
+            avoid writing the file to disk.
 
     Yields:
         Path: The path to the parquet file.
+
+    Raises:
+        HTTPStatusError: If the server responds with an error status.
     """
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmpdir:
         fn = url.split("/")[-1]
         path = Path(tmpdir) / fn.replace(".gz", ".parquet")
 
-        pvstream.parquet_from_url(
-            url,
-            str(path),
-            batch_size=batch_size,
-            line_regex=line_regex,
-            domain_codes=domain_codes,
-            page_title=page_title,
-            min_views=min_views,
-            max_views=max_views,
-            languages=languages,
-            domains=domains,
-            mobile=mobile,
-        )
+        try:
+            pvstream.parquet_from_url(
+                url,
+                str(path),
+                batch_size=batch_size,
+                line_regex=line_regex,
+                domain_codes=domain_codes,
+                page_title=page_title,
+                min_views=min_views,
+                max_views=max_views,
+                languages=languages,
+                domains=domains,
+                mobile=mobile,
+            )
+        except OSError as e:
+            match = HTTP_STATUS_RE.search(str(e))
+            if match is None:
+                raise
+            raise HTTPStatusError(int(match.group(1)), str(e)) from e
 
         yield path
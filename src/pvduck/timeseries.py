@@ -4,6 +4,13 @@ from datetime import datetime, timedelta
 from enum import Enum
 from typing import Optional
 
+# Version 2 scores identify a timestamp by its number of hours since the
+# epoch, and mix it with the SplitMix64 constants below.
+EPOCH = datetime(1970, 1, 1)
+HOUR = timedelta(hours=1)
+MASK64 = 2**64 - 1
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+
 
 class TimestampOrder(Enum):
     CHRONOLOGICAL = "chronological"
@@ -17,6 +24,7 @@ def timeseries(
     sample_rate: float = 1.0,
     seed: int | float | str | bytes | bytearray | None = None,
     order: TimestampOrder = TimestampOrder.RANDOM,
+    score_version: int = 1,
 ) -> list[datetime]:
     """Generate datetimes corresponding to Wikimedia dump files between the two
     dates. If `sample_rate` is less than 1.0, a random subset is chosen.
@@ -39,6 +47,9 @@ def timeseries(
             The random seed to use for sampling.
         order (TimestampOrder): The order the datetimes are returned in.
             Can be `chronological`, `reverse_chronological`, or `random`.
+        score_version (int): How timestamps are scored. Each version ranks
+            timestamps differently, so a project must keep the version it
+            was created with. Version 2 is faster to compute.
 
     Yields:
         datetime: A datetime in the range.
@@ -53,29 +64,43 @@ def timeseries(
     start_date = start_date.replace(minute=0, second=0, microsecond=0)
     end_date = end_date.replace(minute=0, second=0, microsecond=0)
 
-    # Generate all timestamps
-    timestamps: list[tuple[datetime, float]] = []
-    while start_date <= end_date:
-        score = _timestamp_score(start_date, seed)
-        if score < sample_rate:
-            timestamps.append((start_date, score))
-        start_date += timedelta(hours=1)
+    # Hours are numbered from the start date, and only turned back into
+    # datetimes when they are returned.
+    count = (end_date - start_date) // HOUR + 1
+
+    # Everything is included, and the order doesn't depend on the scores,
+    # so there is no need to compute them.
+    if sample_rate >= 1.0 and order != TimestampOrder.RANDOM:
+        hours = [start_date + HOUR * offset for offset in range(count)]
+        if order == TimestampOrder.REVERSE_CHRONOLOGICAL:
+            hours.reverse()
+        return hours
+
+    # Scores and selected offsets are kept in separate lists, and offsets
+    # are sorted by looking up their score, without building a tuple per
+    # hour.
+    scores = _timestamp_scores(start_date, count, seed, score_version)
+    offsets = [
+        offset for offset, score in enumerate(scores) if score < sample_rate
+    ]
 
     # Determine order of returned timestamps
     if order == TimestampOrder.RANDOM:
-        timestamps.sort(key=lambda x: x[1])
+        offsets.sort(key=scores.__getitem__)
     elif order == TimestampOrder.REVERSE_CHRONOLOGICAL:
-        timestamps.reverse()
+        offsets.reverse()
 
     # Generate timestamps
-    return [dt for dt, _ in timestamps]
+    return [start_date + HOUR * offset for offset in offsets]
 
 
-def _timestamp_score(
-    timestamp: datetime,
+def _timestamp_scores(
+    start: datetime,
+    count: int,
     seed: int | float | str | bytes | bytearray | None = None,
-) -> float:
-    """Create a score for the timestamp.
+    version: int = 1,
+) -> list[float]:
+    """Create a score for each of `count` consecutive hours from `start`.
 
     The score of a timestamp is random, but deterministic for a single seed.
     This ensures consistency in how timestamps are ranked even if we change
@@ -85,17 +110,56 @@ def _timestamp_score(
     This should be avoided when working with the same file, as we intentionally
     want to avoid changing history when we expand the range of timestamps.
 
+    The seed is the same for all timestamps, so its part of the hash input is
+    only prepared once.
+
     Args:
-        timestamp (datetime): The timestamp to score.
+        start (datetime): The first hour to score.
+        count (int): The number of hours to score.
         seed (int | float | str | bytes | bytearray | None):
             The random seed to use for scoring.
+        version (int): The scoring version to use.
 
     Returns:
-        float: The score of the timestamp in the range [0.0, 1.0)
-    """
-    input = f"{timestamp.isoformat()}|{seed!r}"
+        list[float]: The score of each hour in the range [0.0, 1.0)
 
-    hash_digest = hashlib.md5(input.encode()).hexdigest()
-    hash_int = int(hash_digest, 16)
-
-    return random.Random(hash_int).random()
+    Raises:
+        ValueError: If the scoring version is unknown.
+    """
+    if version not in (1, 2):
+        raise ValueError(f"Unknown score version: {version}")
+
+    md5 = hashlib.md5
+
+    if version == 1:
+        # The original scoring hashes the timestamp followed by the seed,
+        # then seeds a Mersenne Twister with the hash and draws one number
+        # from it. The digest is read as a big endian integer, which is the
+        # same number the hex digest would parse to.
+        suffix = f"|{seed!r}"
+        scores = []
+        for offset in range(count):
+            text = f"{(start + HOUR * offset).isoformat()}{suffix}"
+            digest = md5(text.encode()).digest()
+            scores.append(
+                random.Random(int.from_bytes(digest, "big")).random()
+            )
+
+        return scores
+
+    # Version 2 derives a 64 bit key from the seed once, and mixes it with
+    # the number of hours since the epoch using the SplitMix64 finalizer.
+    # The output is uniform enough to rank timestamps, at a fraction of the
+    # cost of a hash per hour. Its top 53 bits are turned into a float
+    # directly, the same way `random()` does it.
+    key = int.from_bytes(md5(repr(seed).encode()).digest()[:8], "big")
+    first = (start - EPOCH) // HOUR
+    scores = []
+    for hour in range(first, first + count):
+        z = (key + hour * GOLDEN_GAMMA) & MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E7B5) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+        z ^= z >> 31
+        scores.append((z >> 11) * 2**-53)
+
+    return scores
@@ -1,6 +1,10 @@
-from datetime import date, datetime
+import os
+from datetime import date, datetime, time
 from typing import Any, Optional
 
+# Dates are converted to datetimes at the start of the day
+MIDNIGHT = time()
+
 
 def mandatory_datetime(input: Any) -> datetime:
     """Validate an input date and convert it to a datetime object.
@@ -15,7 +19,7 @@ def mandatory_datetime(input: Any) -> datetime:
     if not isinstance(input, date):
         raise ValueError(f"Invalid date format: {input}")
 
-    return datetime.combine(input, datetime.min.time())
+    return datetime.combine(input, MIDNIGHT)
 
 
 def optional_datetime(input: Any) -> Optional[datetime]:
@@ -32,3 +36,26 @@ def optional_datetime(input: Any) -> Optional[datetime]:
         return None
 
     return mandatory_datetime(input)
+
+
+def writable_directory(input: Optional[str]) -> Optional[str]:
+    """Validate that a directory exists and files can be created in it.
+
+    Args:
+        input (Optional[str]): The path to the directory, or None.
+
+    Returns:
+        Optional[str]: The unchanged input.
+
+    Raises:
+        ValueError: If the directory is missing or not writable.
+    """
+    if input is None:
+        return None
+
+    if not os.path.isdir(input):
+        raise ValueError(f"Directory does not exist: {input}")
+    if not os.access(input, os.W_OK | os.X_OK):
+        raise ValueError(f"Directory is not writable: {input}")
+
+    return input
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 
 # Official mirror. You are recommended to look for a mirror closer to you:
 # https://meta.wikimedia.org/wiki/Mirroring_Wikimedia_project_XML_dumps
@@ -7,7 +8,7 @@ BASE_URL = "https://dumps.wikimedia.org/"
 
 def url_from_timestamp(
     base_url: str = BASE_URL,
-    timestamp: datetime = datetime.now(),
+    timestamp: Optional[datetime] = None,
 ) -> str:
     """Create a full Wikimedia dump URL from a timestamp.
 
@@ -18,14 +19,19 @@ def url_from_timestamp(
         base_url (str): The base URL of the Wikimedia dump server. This URL
             should point to a page that contains an 'other' directory where
             the dumps are stored.
-        timestamp (datetime): The timestamp to format.
+        timestamp (Optional[datetime]): The timestamp to format.
+            If None, the current time will be used.
 
     Returns:
         str: The full URL to the dump file.
     """
-    year = timestamp.strftime("%Y")
-    month = timestamp.strftime("%m")
-    dt = timestamp.strftime("%Y%m%d-%H0000")
+    if timestamp is None:
+        timestamp = datetime.now()
+
+    # Format the fields directly, which is much faster than strftime
+    year = f"{timestamp.year:04d}"
+    month = f"{timestamp.month:02d}"
+    dt = f"{year}{month}{timestamp.day:02d}-{timestamp.hour:02d}0000"
     fn = f"pageviews-{dt}.gz"
 
     return f"{base_url}other/pageviews/{year}/{year}-{month}/{fn}"
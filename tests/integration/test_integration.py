@@ -10,7 +10,7 @@ import pytest
 from _pytest.monkeypatch import MonkeyPatch
 
 from pvduck.cli import compact, create, edit, ls, open, rm, status, sync
-from pvduck.config import CONFIG_ROOT, DATA_ROOT
+from pvduck.config import config_path, database_path
 
 
 @pytest.mark.integration
@@ -73,7 +73,10 @@ def test_full_run(monkeypatch: MonkeyPatch) -> None:
     assert "- Progress: 3/" in out
 
     # Try to open the database (mocked)
-    with patch("pvduck.config.subprocess.run") as mock_run:
+    with (
+        patch("pvduck.project.shutil.which", return_value="duckdb"),
+        patch("pvduck.config.subprocess.run") as mock_run,
+    ):
         open(project_name)
         mock_run.assert_called_once()
 
@@ -105,7 +108,7 @@ def test_exception_in_file(monkeypatch: MonkeyPatch) -> None:
 
     # Make sure a failed sync stops the process
     with patch(
-        "pvduck.cli.parquet_from_url",
+        "pvduck.stream.parquet_from_url",
         side_effect=RuntimeError("Test error"),
     ):
         sync(project_name, max_files=1)
@@ -157,12 +160,69 @@ def test_disallowed_commands(monkeypatch: MonkeyPatch) -> None:
         rm(project_name)
 
 
+@pytest.mark.integration
+def test_command_errors(monkeypatch: MonkeyPatch) -> None:
+    """Errors from within a command are not reported as a missing or
+    existing project."""
+    project_name = "".join(random.choices(string.ascii_lowercase, k=10))
+
+    # A missing editor raises FileNotFoundError from `subprocess.run`
+    monkeypatch.setenv("EDITOR", "pvduck-missing-editor")
+
+    with pytest.raises(FileNotFoundError):
+        create(project_name)
+
+    assert not _project_exists(project_name)
+
+
+@pytest.mark.integration
+def test_edit_without_database(monkeypatch: MonkeyPatch) -> None:
+    """The config of a project can be edited without its database."""
+    project_name = "".join(random.choices(string.ascii_lowercase, k=10))
+    monkeypatch.setenv("EDITOR", "true")
+
+    create(project_name)
+    database_path(project_name).unlink()
+
+    try:
+        edit(project_name)
+    finally:
+        config_path(project_name).unlink()
+
+
+@pytest.mark.integration
+def test_rm_keep_database(
+    monkeypatch: MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    """A database kept after removing its project blocks the name, and the
+    error says where it is."""
+    project_name = "".join(random.choices(string.ascii_lowercase, k=10))
+    monkeypatch.setenv("EDITOR", "true")
+
+    create(project_name)
+    rm(project_name, delete_database=False)
+    capsys.readouterr()
+
+    try:
+        with pytest.raises(SystemExit):
+            create(project_name)
+
+        # The path may be wrapped over several lines
+        out = capsys.readouterr().out.replace("\n", "")
+        assert str(database_path(project_name)) in out
+    finally:
+        database_path(project_name).unlink()
+
+    create(project_name)
+    rm(project_name)
+
+
 def _project_exists(project_name) -> bool:
     """Check if the project files exist and are returned from `ls`."""
-    if not (CONFIG_ROOT / f"{project_name}.yml").is_file():
+    if not config_path(project_name).is_file():
         return False
 
-    if not (DATA_ROOT / f"{project_name}.duckdb").is_file():
+    if not database_path(project_name).is_file():
         return False
 
     out = _capture_stdout(ls)
@@ -183,7 +243,7 @@ def _capture_stdout(fn: Callable, *args, **kwargs) -> str:
 
 def _pageviews_count(project_name: str) -> int:
     """Count the number of rows in the database."""
-    db_path = DATA_ROOT / f"{project_name}.duckdb"
+    db_path = database_path(project_name)
 
     with duckdb.connect(db_path) as conn:
         result = conn.execute("SELECT COUNT(*) FROM pageviews").fetchone()
@@ -192,7 +252,7 @@ def _pageviews_count(project_name: str) -> int:
 
 def _main_page_views(project_name: str) -> Optional[int]:
     """Count the number of pageviews for the english desktop main page."""
-    db_path = DATA_ROOT / f"{project_name}.duckdb"
+    db_path = database_path(project_name)
 
     with duckdb.connect(db_path) as conn:
         result = conn.execute(
@@ -209,7 +269,7 @@ def _main_page_views(project_name: str) -> Optional[int]:
 
 def _log_count(project_name: str, success_only: bool = False) -> int:
     """Count the number of rows in the log table."""
-    db_path = DATA_ROOT / f"{project_name}.duckdb"
+    db_path = database_path(project_name)
 
     sql = "SELECT COUNT(*) FROM log"
     if success_only:
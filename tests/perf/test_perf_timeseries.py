@@ -0,0 +1,41 @@
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+import pytest
+
+from pvduck.timeseries import TimestampOrder, timeseries
+
+if TYPE_CHECKING:
+    from pytest_benchmark.fixture import BenchmarkFixture
+
+pytest.importorskip("pytest_benchmark")
+
+# One year of hourly timestamps
+START_DATE = datetime(2024, 1, 1)
+END_DATE = datetime(2024, 12, 31, 23)
+
+
+@pytest.mark.benchmark(group="timeseries")
+@pytest.mark.parametrize("score_version", [1, 2])
+def test_bench_timeseries(
+    benchmark: "BenchmarkFixture", score_version: int
+) -> None:
+    """Sample and rank a year of timestamps."""
+    result = benchmark(
+        timeseries,
+        START_DATE,
+        END_DATE,
+        sample_rate=0.5,
+        seed=42,
+        score_version=score_version,
+    )
+    assert 0 < len(result) < 8784
+
+
+@pytest.mark.benchmark(group="timeseries")
+def test_bench_timeseries_chronological(benchmark: "BenchmarkFixture") -> None:
+    """List a year of timestamps without sampling, which skips scoring."""
+    result = benchmark(
+        timeseries, START_DATE, END_DATE, order=TimestampOrder.CHRONOLOGICAL
+    )
+    assert len(result) == 8784
@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+
+import pytest
+
+from pvduck.wikimedia import url_from_timestamp
+
+if TYPE_CHECKING:
+    from pytest_benchmark.fixture import BenchmarkFixture
+
+pytest.importorskip("pytest_benchmark")
+
+TIMESTAMPS = [datetime(2024, 1, 1) + timedelta(hours=i) for i in range(10000)]
+
+
+@pytest.mark.benchmark(group="wikimedia")
+def test_bench_url_from_timestamp(benchmark: "BenchmarkFixture") -> None:
+    """Create the URLs of 10 000 dump files."""
+    urls = benchmark(
+        lambda: [url_from_timestamp(timestamp=ts) for ts in TIMESTAMPS]
+    )
+    assert len(urls) == len(TIMESTAMPS)
@@ -0,0 +1,38 @@
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import duckdb
+import pytest
+
+from pvduck.db import create_db, update_from_parquet, update_log
+
+FILES = Path(__file__).parent.parent / "files"
+
+
+@pytest.fixture(scope="session")
+def populated_db_template(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """A database filled from the first parquet sample, built once per
+    session. Tests must not modify it, use `populated_db` instead."""
+    db_path = tmp_path_factory.mktemp("populated") / "template.duckdb"
+
+    create_db(db_path)
+    update_from_parquet(db_path, FILES / "pageviews-20240818-100000.parquet")
+    update_log(db_path, datetime(2024, 8, 18, 10), True)
+
+    # Write everything from the WAL to the database file, so the file can
+    # be copied on its own.
+    with duckdb.connect(db_path) as connection:
+        connection.execute("CHECKPOINT")
+
+    return db_path
+
+
+@pytest.fixture
+def populated_db(populated_db_template: Path, tmp_path: Path) -> Path:
+    """A private copy of the populated database. Copying the file is much
+    cheaper than filling a new database from parquet."""
+    db_path = tmp_path / "test.duckdb"
+    shutil.copy(populated_db_template, db_path)
+
+    return db_path
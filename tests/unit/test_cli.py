@@ -0,0 +1,352 @@
+import errno
+import threading
+import time
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Union
+
+import pytest
+
+from pvduck import config, db, stream
+from pvduck.cli import MAX_RETRIES, _calibrate, _Throttle, sync
+from pvduck.config import read_config
+from pvduck.db import create_db, read_log_timestamps
+from pvduck.stream import HTTPStatusError
+
+FILES = Path(__file__).parent.parent / "files"
+SAMPLE = FILES / "pageviews-20240818-100000.parquet"
+
+# A day of files, without sleeping between the downloads
+CONFIG = """
+base_url: https://dumps.wikimedia.org/
+sleep_time: 0
+max_parallel_downloads: {max_parallel_downloads}
+start_date: 2024-08-18
+end_date: 2024-08-19
+sample_rate: 1.0
+score_version: 2
+line_regex:
+domain_codes:
+page_title:
+min_views:
+max_views:
+languages:
+domains:
+mobile:
+"""
+
+# What a download does: raise an exception, serve another file than the
+# sample, or take a number of seconds before serving the sample
+Outcome = Union[Exception, Path, float]
+
+
+class FakeDownloads:
+    """Stand-in for `pvduck.stream.parquet_from_url`, serving the sample
+    file for every download. Outcomes queued for a timestamp are used by
+    its downloads first, one per attempt."""
+
+    def __init__(self) -> None:
+        self.outcomes: dict[datetime, list[Outcome]] = {}
+        self.started: list[datetime] = []
+        self.peak = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, url: str, **kwargs: Any) -> Generator[Path, None, None]:
+        name = url.rsplit("/", 1)[-1]
+        timestamp = datetime.strptime(name, "pageviews-%Y%m%d-%H%M%S.gz")
+        queued = self.outcomes.get(timestamp)
+        outcome = queued.pop(0) if queued else SAMPLE
+
+        with self._lock:
+            self.started.append(timestamp)
+            self._active += 1
+            self.peak = max(self.peak, self._active)
+
+        try:
+            if isinstance(outcome, Exception):
+                raise outcome
+            if not isinstance(outcome, Path):
+                time.sleep(outcome)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+        yield outcome if isinstance(outcome, Path) else SAMPLE
+
+
+@pytest.fixture
+def project(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> str:
+    """A project with an empty database, in private directories."""
+    monkeypatch.setattr(config, "CONFIG_ROOT", tmp_path / "config")
+    monkeypatch.setattr(config, "DATA_ROOT", tmp_path / "data")
+    monkeypatch.setattr(config, "CACHE_ROOT", tmp_path / "cache")
+
+    config.CONFIG_ROOT.mkdir()
+    config.DATA_ROOT.mkdir()
+    _write_config("test", max_parallel_downloads=1)
+    create_db(config.database_path("test"))
+
+    return "test"
+
+
+@pytest.fixture
+def downloads(monkeypatch: pytest.MonkeyPatch) -> FakeDownloads:
+    """Replace the downloads with local files."""
+    fake = FakeDownloads()
+    monkeypatch.setattr(stream, "parquet_from_url", fake)
+    return fake
+
+
+@pytest.fixture
+def merges(monkeypatch: pytest.MonkeyPatch) -> list[list[datetime]]:
+    """Record the timestamps in each batch merged into the database."""
+    batches: list[list[datetime]] = []
+    update_from_parquets = db.update_from_parquets
+
+    def recording_update_from_parquets(
+        db_path: Path, parquets: dict[datetime, Path], *args: Any
+    ) -> None:
+        batches.append(list(parquets))
+        update_from_parquets(db_path, parquets, *args)
+
+    monkeypatch.setattr(
+        db, "update_from_parquets", recording_update_from_parquets
+    )
+    return batches
+
+
+@pytest.fixture
+def backoffs(monkeypatch: pytest.MonkeyPatch) -> list[float]:
+    """Record the backoff delays instead of waiting for them."""
+    delays: list[float] = []
+    monkeypatch.setattr(
+        _Throttle, "backoff", lambda self, delay: delays.append(delay)
+    )
+    return delays
+
+
+@pytest.mark.parametrize("parallel", [1, 3])
+def test_sync_batches(
+    project: str,
+    downloads: FakeDownloads,
+    merges: list[list[datetime]],
+    monkeypatch: pytest.MonkeyPatch,
+    parallel: int,
+) -> None:
+    """Files are merged in batches, in the order of the timestamps, and no
+    more than `max_parallel_downloads` are downloaded at once."""
+    _write_config(project, max_parallel_downloads=parallel)
+    monkeypatch.setenv("PVDUCK_FILES_PER_BATCH", "2")
+    timestamps = read_config(project).timestamps[:5]
+
+    # A slow first download makes the calibration use every download
+    # allowed, and the later downloads finish in reverse order.
+    downloads.outcomes[timestamps[0]] = [0.3]
+    for delay, timestamp in zip([0.2, 0.1, 0.0], timestamps[1:]):
+        downloads.outcomes[timestamp] = [delay]
+
+    sync(project, max_files=5)
+
+    # The first file is merged on its own by the calibration
+    assert merges == [timestamps[:1], timestamps[1:3], timestamps[3:5]]
+    assert downloads.peak <= parallel
+
+    database = config.database_path(project)
+    assert read_log_timestamps(database, success=True) == set(timestamps)
+
+
+def test_sync_prefetch(
+    project: str,
+    downloads: FakeDownloads,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """With a single download allowed, the next file is still downloaded
+    while the database is being updated."""
+    monkeypatch.setenv("PVDUCK_FILES_PER_BATCH", "1")
+    timestamps = read_config(project).timestamps[:3]
+    update_from_parquets = db.update_from_parquets
+    prefetched: list[bool] = []
+
+    def waiting_update_from_parquets(
+        db_path: Path, parquets: dict[datetime, Path], *args: Any
+    ) -> None:
+        # The calibration merges the first file before downloading more,
+        # and nothing is left to download while merging the last one.
+        (timestamp,) = parquets
+        if timestamp == timestamps[1]:
+            deadline = time.monotonic() + 2
+            while timestamps[2] not in downloads.started:
+                if time.monotonic() > deadline:
+                    break
+                time.sleep(0.01)
+            prefetched.append(timestamps[2] in downloads.started)
+
+        update_from_parquets(db_path, parquets, *args)
+
+    monkeypatch.setattr(
+        db, "update_from_parquets", waiting_update_from_parquets
+    )
+
+    sync(project, max_files=3)
+
+    assert prefetched == [True]
+    assert downloads.peak == 1
+
+
+@pytest.mark.parametrize(
+    "error, logged",
+    [
+        # Broken files are logged, so they are not downloaded again
+        (HTTPStatusError(404, "Not Found"), True),
+        (RuntimeError("Broken"), True),
+        # pvstream raises OSError without an errno for all its errors
+        (OSError("Corrupt gzip stream"), True),
+        # Local errors are skipped, so the next sync retries the file
+        (OSError(errno.ENOSPC, "No space left on device"), False),
+        (FileNotFoundError(errno.ENOENT, "No such directory"), False),
+    ],
+)
+def test_sync_failed_download(
+    project: str,
+    downloads: FakeDownloads,
+    error: Exception,
+    logged: bool,
+) -> None:
+    """A failed download is logged as failed or skipped, and the other
+    files are synced either way."""
+    first, failed, *_ = read_config(project).timestamps
+    downloads.outcomes[failed] = [error]
+
+    sync(project, max_files=3)
+
+    database = config.database_path(project)
+    assert len(read_log_timestamps(database, success=True)) == 2
+    assert (failed in read_log_timestamps(database, success=False)) == logged
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_sync_retry(
+    project: str,
+    downloads: FakeDownloads,
+    backoffs: list[float],
+    status: int,
+) -> None:
+    """Rate limited downloads are retried with exponential backoff."""
+    first, retried, *_ = read_config(project).timestamps
+    downloads.outcomes[retried] = [
+        HTTPStatusError(status, "Rate limited"),
+        HTTPStatusError(status, "Rate limited"),
+    ]
+
+    sync(project, max_files=2)
+
+    assert backoffs == [2, 4]
+
+    database = config.database_path(project)
+    assert read_log_timestamps(database, success=True) == {first, retried}
+
+
+def test_sync_retries_exhausted(
+    project: str,
+    downloads: FakeDownloads,
+    backoffs: list[float],
+) -> None:
+    """A download still rate limited after every retry is skipped, so the
+    next sync tries it again."""
+    first, retried, *_ = read_config(project).timestamps
+    downloads.outcomes[retried] = [
+        HTTPStatusError(429, "Too Many Requests")
+    ] * (MAX_RETRIES + 2)
+
+    sync(project, max_files=2)
+
+    # One attempt, then MAX_RETRIES retries, and no more
+    assert len(backoffs) == MAX_RETRIES
+    assert len(downloads.outcomes[retried]) == 1
+
+    database = config.database_path(project)
+    assert read_log_timestamps(database) == {first}
+
+
+def test_sync_broken_file(
+    project: str,
+    downloads: FakeDownloads,
+    merges: list[list[datetime]],
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """When a batch fails, its files are merged one at a time, and only the
+    broken file is logged as failed."""
+    monkeypatch.setenv("PVDUCK_FILES_PER_BATCH", "3")
+    timestamps = read_config(project).timestamps[:4]
+
+    broken = tmp_path / "broken.parquet"
+    broken.write_text("not a parquet file")
+    downloads.outcomes[timestamps[2]] = [broken]
+
+    sync(project, max_files=4)
+
+    assert merges == [
+        timestamps[:1],
+        timestamps[1:4],
+        *[[timestamp] for timestamp in timestamps[1:4]],
+    ]
+
+    database = config.database_path(project)
+    assert read_log_timestamps(database, success=False) == {timestamps[2]}
+    assert read_log_timestamps(database, success=True) == {
+        timestamps[0],
+        timestamps[1],
+        timestamps[3],
+    }
+
+
+@pytest.mark.parametrize("failed", [False, True])
+def test_calibrate(
+    project: str,
+    downloads: FakeDownloads,
+    monkeypatch: pytest.MonkeyPatch,
+    failed: bool,
+) -> None:
+    """The first file is merged and timed on its own, even when it fills a
+    batch. A failed download leaves nothing to time."""
+    _write_config(project, max_parallel_downloads=4)
+    monkeypatch.setenv("PVDUCK_FILES_PER_BATCH", "1")
+
+    # Merging is much slower than downloading, so one download is enough
+    update_from_parquets = db.update_from_parquets
+
+    def slow_update_from_parquets(*args: Any, **kwargs: Any) -> None:
+        time.sleep(0.2)
+        update_from_parquets(*args, **kwargs)
+
+    monkeypatch.setattr(db, "update_from_parquets", slow_update_from_parquets)
+
+    project_config = read_config(project)
+    first = project_config.timestamps[0]
+    if failed:
+        downloads.outcomes[first] = [RuntimeError("Broken")]
+
+    parquets: dict[datetime, Path] = {}
+    with ThreadPoolExecutor() as pool, ExitStack() as batch:
+        parallel = _calibrate(
+            project_config, first, _Throttle(0), pool, batch, parquets
+        )
+
+    assert parallel == (4 if failed else 1)
+    assert parquets == {}
+    assert read_log_timestamps(
+        project_config.database_path, success=not failed
+    ) == {first}
+
+
+def _write_config(project_name: str, max_parallel_downloads: int) -> None:
+    """Write the config of the test project."""
+    config.config_path(project_name).write_text(
+        CONFIG.format(max_parallel_downloads=max_parallel_downloads)
+    )
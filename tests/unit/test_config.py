@@ -0,0 +1,97 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from pydantic import ValidationError
+
+from pvduck import config
+from pvduck.config import read_config
+
+
+@pytest.fixture
+def project(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> str:
+    """A project with the default config, in a private config directory."""
+    monkeypatch.setattr(config, "CONFIG_ROOT", tmp_path / "config")
+    monkeypatch.setattr(config, "CACHE_ROOT", tmp_path / "cache")
+
+    config.CONFIG_ROOT.mkdir()
+    shutil.copy(
+        config.ASSETS_ROOT / "default_config.yml",
+        config.config_path("test"),
+    )
+
+    return "test"
+
+
+def test_read_config_cache(project: str) -> None:
+    """The parsed config is cached, and the cache is used while the config
+    file is unchanged."""
+    first = read_config(project)
+    assert config.cache_path(project).is_file()
+
+    second = read_config(project)
+    assert second == first
+
+
+def test_read_config_unwritable_cache(
+    project: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Failing to write the cache does not fail reading the config."""
+    # A file where the cache directory should be makes every write fail
+    blocker = tmp_path / "blocker"
+    blocker.touch()
+    monkeypatch.setattr(config, "CACHE_ROOT", blocker / "cache")
+
+    assert read_config(project).base_url == "https://dumps.wikimedia.org/"
+    assert list(tmp_path.glob("**/*.tmp")) == []
+
+
+def test_tmp_dir(
+    project: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """The directory for temporary files must exist when the config is
+    loaded, so a typo doesn't fail every download."""
+    # The system's temporary directory is used unless one is chosen
+    monkeypatch.delenv("PVDUCK_TMPDIR", raising=False)
+    assert read_config(project).tmp_dir is None
+
+    monkeypatch.setenv("PVDUCK_TMPDIR", str(tmp_path))
+    assert read_config(project).tmp_dir == str(tmp_path)
+
+    monkeypatch.setenv("PVDUCK_TMPDIR", str(tmp_path / "missing"))
+    with pytest.raises(ValidationError):
+        read_config(project)
+
+
+def test_files_per_batch(
+    project: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """The environment variable is held to the same bounds as the field."""
+    monkeypatch.setenv("PVDUCK_FILES_PER_BATCH", "2")
+    assert read_config(project).files_per_batch == 2
+
+    monkeypatch.setenv("PVDUCK_FILES_PER_BATCH", "0")
+    with pytest.raises(ValidationError):
+        read_config(project)
+
+
+def test_merge_strategy(project: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Only the known strategies are accepted from the environment."""
+    monkeypatch.setenv("PVDUCK_MERGE_STRATEGY", "rebuild")
+    assert read_config(project).merge_strategy == "rebuild"
+
+    monkeypatch.setenv("PVDUCK_MERGE_STRATEGY", "bogus")
+    with pytest.raises(ValidationError):
+        read_config(project)
+
+
+def test_batch_size(project: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    """The environment variable is held to the same bounds as the field."""
+    assert read_config(project).batch_size is None
+
+    monkeypatch.setenv("PVDUCK_BATCH_SIZE", "65536")
+    assert read_config(project).batch_size == 65536
+
+    monkeypatch.setenv("PVDUCK_BATCH_SIZE", "0")
+    with pytest.raises(ValidationError):
+        read_config(project)
@@ -1,217 +1,321 @@
-import shutil
-import tempfile
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 import duckdb
 import pytest
 
 from pvduck.db import (
+    CompactMode,
+    MergeStrategy,
+    analyze_db,
     compact_db,
+    count_log_entries,
     create_db,
+    pending_timestamps,
     read_log_timestamps,
     update_from_parquet,
+    update_from_parquets,
     update_log,
 )
 
+FILES = Path(__file__).parent.parent / "files"
 
-def test_create() -> None:
+# Row count and highest view count, enough to tell the samples apart
+SUMMARY_QUERY = "SELECT COUNT(*), MAX(views) FROM pageviews"
+
+# The constraints created with the pageviews table, which a rebuilt or
+# compacted table must still have
+CONSTRAINTS_QUERY = """
+SELECT constraint_type, constraint_column_names
+FROM duckdb_constraints()
+WHERE table_name = 'pageviews'
+ORDER BY ALL
+"""
+PAGEVIEWS_CONSTRAINTS = [
+    ("NOT NULL", ["domain"]),
+    ("NOT NULL", ["domain_code"]),
+    ("NOT NULL", ["language"]),
+    ("NOT NULL", ["mobile"]),
+    ("NOT NULL", ["page_title"]),
+    ("NOT NULL", ["views"]),
+    ("PRIMARY KEY", ["domain_code", "page_title"]),
+]
+
+
+def _constraints(db_path: Path) -> list[tuple[str, list[str]]]:
+    """List the constraints on the pageviews table."""
+    with duckdb.connect(db_path) as connection:
+        return connection.execute(CONSTRAINTS_QUERY).fetchall()
+
+
+def _summary(db_path: Path) -> tuple[int, Optional[int]]:
+    """Count the rows and find the highest view count in a database."""
+    with duckdb.connect(db_path) as connection:
+        count, views = connection.execute(SUMMARY_QUERY).fetchall()[0]
+
+    return count, views
+
+
+def test_create(tmp_path: Path) -> None:
     """Test creating a new database."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # Make sure we can create a new table
-        db_path = Path(tmpdir) / "test.duckdb"
-        assert not db_path.exists()
+    # Make sure we can create a new table
+    db_path = tmp_path / "test.duckdb"
+    assert not db_path.exists()
 
-        create_db(db_path)
+    create_db(db_path)
 
-        assert db_path.is_file()
+    assert db_path.is_file()
 
-        with duckdb.connect(db_path) as connection:
-            tables = connection.sql("SHOW TABLES").fetchall()
-            assert len(tables) == 2
-            assert tables[0][0] == "log"
-            assert tables[1][0] == "pageviews"
+    with duckdb.connect(db_path) as connection:
+        tables = connection.sql("SHOW TABLES").fetchall()
+        assert len(tables) == 2
+        assert tables[0][0] == "log"
+        assert tables[1][0] == "pageviews"
 
-        # Make sure we can't overwrite an existing table
-        with pytest.raises(FileExistsError):
-            create_db(db_path)
+    # Make sure we can't overwrite an existing table
+    with pytest.raises(FileExistsError):
+        create_db(db_path)
 
 
-def test_update_from_parquet() -> None:
+@pytest.mark.parametrize("strategy", ["update", "rebuild"])
+def test_update_from_parquet(tmp_path: Path, strategy: MergeStrategy) -> None:
     """Test updating the database from a parquet file."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        db_path = Path(tmpdir) / "test.duckdb"
-        create_db(db_path)
+    db_path = tmp_path / "test.duckdb"
+    create_db(db_path)
 
-        # Copy the parquet file to the temporary directory
-        parquet_src = [
-            Path(__file__).parent.parent / "files" / fn
-            for fn in [
-                "pageviews-20240818-100000.parquet",
-                "pageviews-20240818-110000.parquet",
-            ]
-        ]
-        parquet_target = [
-            Path(tmpdir) / fn
-            for fn in [
-                "pageviews-20240818-100000.parquet",
-                "pageviews-20240818-110000.parquet",
-            ]
-        ]
-
-        for src, target in zip(parquet_src, parquet_target):
-            if target.exists():
-                target.unlink()
-            shutil.copy(src, target)
-
-        # Check that the database is empty
-        query = """
-            SELECT domain_code, language, domain, mobile, page_title, views
-            FROM pageviews
-            ORDER BY views DESC
-        """
-
-        with duckdb.connect(db_path) as connection:
-            result = connection.sql(query).fetchall()
-            assert len(result) == 0
-
-        # Fill the database from a parquet file and check the result
-        update_from_parquet(db_path, parquet_target[0])
-
-        with duckdb.connect(db_path) as connection:
-            result = connection.sql(query).fetchall()
-            assert len(result) == 17
-            assert result[0][5] == 74953
-
-        # Fill with the same parquet file again. This should not insert any
-        # new rows, but all view counts should double.
-        update_from_parquet(db_path, parquet_target[0])
-
-        with duckdb.connect(db_path) as connection:
-            result = connection.sql(query).fetchall()
-            assert len(result) == 17
-            assert result[0][5] == 74953 * 2
-
-        # Fill with a different parquet file. This should insert new rows
-        # and update existing ones.
-        update_from_parquet(db_path, parquet_target[1])
-
-        with duckdb.connect(db_path) as connection:
-            result = connection.sql(query).fetchall()
-            assert len(result) == 19
-            assert result[0][5] == 223034
-
-        # Make sure we can't fill from a non-existing parquet file
-        with pytest.raises(FileNotFoundError):
-            update_from_parquet(
-                Path(tmpdir) / "non_existing.duckdb", parquet_target[0]
-            )
+    first = FILES / "pageviews-20240818-100000.parquet"
+    second = FILES / "pageviews-20240818-110000.parquet"
+
+    # Check that the database is empty
+    assert _summary(db_path) == (0, None)
+
+    # Fill the database from a parquet file and check the result
+    update_from_parquet(db_path, first, strategy=strategy)
+
+    assert _summary(db_path) == (17, 74953)
+
+    # Fill with the same parquet file again. This should not insert any
+    # new rows, but all view counts should double.
+    update_from_parquet(db_path, first, strategy=strategy)
+
+    assert _summary(db_path) == (17, 74953 * 2)
+
+    # Fill with a different parquet file. This should insert new rows
+    # and update existing ones.
+    update_from_parquet(db_path, second, strategy=strategy)
+
+    assert _summary(db_path) == (19, 223034)
+    assert _constraints(db_path) == PAGEVIEWS_CONSTRAINTS
+
+    # Make sure we can't fill from a non-existing parquet file
+    with pytest.raises(FileNotFoundError):
+        update_from_parquet(tmp_path / "non_existing.duckdb", first)
+
+    with pytest.raises(FileNotFoundError):
+        update_from_parquet(db_path, tmp_path / "non_existing.parquet")
+
+
+def test_update_from_parquets(tmp_path: Path) -> None:
+    """Test merging and logging several parquet files in one transaction."""
+    db_path = tmp_path / "test.duckdb"
+    create_db(db_path)
+
+    first = FILES / "pageviews-20240818-100000.parquet"
+    second = FILES / "pageviews-20240818-110000.parquet"
+    parquets = {
+        datetime(2024, 8, 18, 10): first,
+        datetime(2024, 8, 18, 11): second,
+    }
+
+    # Both files are merged, and both timestamps are logged
+    update_from_parquets(db_path, parquets)
+
+    assert _summary(db_path) == (19, 223034 - 74953)
+
+    assert count_log_entries(db_path) == (2, 0)
+
+    # A broken file rolls back the whole batch
+    broken = tmp_path / "broken.parquet"
+    broken.write_text("not a parquet file")
+
+    with pytest.raises(duckdb.Error):
+        update_from_parquets(
+            db_path,
+            {
+                datetime(2024, 8, 18, 12): first,
+                datetime(2024, 8, 18, 13): broken,
+            },
+        )
+
+    assert _summary(db_path) == (19, 223034 - 74953)
 
-        with pytest.raises(FileNotFoundError):
-            update_from_parquet(db_path, Path(tmpdir) / "non_existing.parquet")
+    assert count_log_entries(db_path) == (2, 0)
+
+    # Make sure we can't fill from a non-existing parquet file
+    with pytest.raises(FileNotFoundError):
+        update_from_parquets(
+            db_path,
+            {datetime(2024, 8, 18, 12): tmp_path / "non_existing"},
+        )
 
 
-def test_compact_db() -> None:
+@pytest.mark.parametrize("mode", ["copy", "inplace"])
+def test_compact_db(populated_db: Path, mode: CompactMode) -> None:
     """Make sure compacting the database does not affect data integrity,
     just the size of the table file (which is not deterministic)."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # Make sure we can create a new table
-        db_path = Path(tmpdir) / "test.duckdb"
-        assert not db_path.exists()
+    assert _summary(populated_db) == (17, 74953)
 
-        create_db(db_path)
+    # Compact the database
+    compact_db(populated_db, mode)
 
-        parquet_src = (
-            Path(__file__).parent.parent
-            / "files"
-            / "pageviews-20240818-100000.parquet"
-        )
-        parquet_target = Path(tmpdir) / "pageviews-20240818-100000.parquet"
-
-        shutil.copy(parquet_src, parquet_target)
-
-        # Fill the database from a parquet file and check the result
-        update_from_parquet(db_path, parquet_target)
-
-        with duckdb.connect(db_path) as connection:
-            result = connection.sql(
-                """
-                SELECT domain_code, language, domain, mobile, page_title, views
-                FROM pageviews
-                ORDER BY views DESC
-            """
-            ).fetchall()
-            assert len(result) == 17
-            assert result[0][5] == 74953
-
-        # Compact the database
-        compact_db(db_path)
-
-        # Check that the database is still valid
-        with duckdb.connect(db_path) as connection:
-            result = connection.sql(
-                """
-                SELECT domain_code, language, domain, mobile, page_title, views
-                FROM pageviews
-                ORDER BY views DESC
-            """
-            ).fetchall()
-            assert len(result) == 17
-            assert result[0][5] == 74953
-
-        # Make sure we can't compact a non-existing database
-        with pytest.raises(FileNotFoundError):
-            compact_db(Path(tmpdir) / "non_existing.duckdb")
-
-
-def test_log() -> None:
-    """Test writing to and reading from the log table."""
-    with tempfile.TemporaryDirectory() as tmpdir:
-        db_path = Path(tmpdir) / "test.duckdb"
-        create_db(db_path)
+    # Check that the database is still valid
+    assert _summary(populated_db) == (17, 74953)
 
-        # Check that the database is empty
-        with duckdb.connect(db_path) as connection:
-            result = connection.sql("SELECT COUNT(*) FROM log").fetchall()
-            assert len(result) == 1
-            assert result[0][0] == 0
-
-        assert read_log_timestamps(db_path) == set()
-        assert read_log_timestamps(db_path, success=True) == set()
-        assert read_log_timestamps(db_path, success=False) == set()
-
-        # Write to the log
-        update_log(db_path, datetime(2024, 1, 1), True)
-
-        with duckdb.connect(db_path) as connection:
-            result = connection.sql("SELECT timestamp FROM log").fetchall()
-            assert len(result) == 1
-            assert result[0][0] == datetime(2024, 1, 1)
-
-        assert read_log_timestamps(db_path) == {datetime(2024, 1, 1)}
-        assert read_log_timestamps(db_path, success=True) == {
-            datetime(2024, 1, 1)
-        }
-        assert read_log_timestamps(db_path, success=False) == set()
-
-        # Make sure failures in recent files are not logged, as they are
-        # assumed to be unavailable from the mirror at check time rather
-        # than permanent errors.
-        update_log(db_path, datetime.now(), False)
-
-        assert read_log_timestamps(db_path) == {datetime(2024, 1, 1)}
-        assert read_log_timestamps(db_path, success=True) == {
-            datetime(2024, 1, 1)
-        }
-        assert read_log_timestamps(db_path, success=False) == set()
-
-        # Make sure we can't read from or write to a non-existing database
-        with pytest.raises(FileNotFoundError):
-            read_log_timestamps(Path(tmpdir) / "non_existing.duckdb")
-
-        with pytest.raises(FileNotFoundError):
-            update_log(
-                Path(tmpdir) / "non_existing.duckdb",
-                datetime(2024, 1, 1),
-                True,
+    # The log and the constraints survive, and nothing is left behind
+    assert count_log_entries(populated_db) == (1, 0)
+    assert _constraints(populated_db) == PAGEVIEWS_CONSTRAINTS
+    assert [p.name for p in populated_db.parent.iterdir()] == ["test.duckdb"]
+
+    with pytest.raises(duckdb.ConstraintException):
+        with duckdb.connect(populated_db) as connection:
+            connection.sql(
+                "INSERT INTO pageviews SELECT * FROM pageviews LIMIT 1"
             )
+
+    # Make sure we can't compact a non-existing database
+    with pytest.raises(FileNotFoundError):
+        compact_db(populated_db.parent / "non_existing.duckdb")
+
+
+# Older versions created a unique index on top of the primary key, and
+# compacting replaced the table with a copy holding only that index
+LEGACY_SCHEMAS = {
+    "created": [
+        "CREATE UNIQUE INDEX unique_pageviews "
+        "ON pageviews (domain_code, page_title)",
+    ],
+    "compacted": [
+        "CREATE OR REPLACE TABLE pageviews AS SELECT * FROM pageviews",
+        "CREATE UNIQUE INDEX unique_pageviews "
+        "ON pageviews (domain_code, page_title)",
+    ],
+}
+
+
+@pytest.mark.parametrize("mode", ["copy", "inplace"])
+@pytest.mark.parametrize("legacy", LEGACY_SCHEMAS)
+def test_compact_db_legacy_schema(
+    populated_db: Path, mode: CompactMode, legacy: str
+) -> None:
+    """Compacting a database from an older version gives it the current
+    schema, so it can still be merged into."""
+    with duckdb.connect(populated_db) as connection:
+        for statement in LEGACY_SCHEMAS[legacy]:
+            connection.sql(statement)
+
+    compact_db(populated_db, mode)
+
+    with duckdb.connect(populated_db) as connection:
+        indexes = connection.sql(
+            "SELECT index_name FROM duckdb_indexes()"
+        ).fetchall()
+
+    assert indexes == []
+    assert _constraints(populated_db) == PAGEVIEWS_CONSTRAINTS
+    assert _summary(populated_db) == (17, 74953)
+
+    update_from_parquet(
+        populated_db, FILES / "pageviews-20240818-110000.parquet"
+    )
+    assert _summary(populated_db) == (19, 223034 - 74953)
+
+
+def test_analyze_db(populated_db: Path) -> None:
+    """Analyzing the database refreshes its statistics, not its data."""
+    analyze_db(populated_db)
+
+    assert _summary(populated_db) == (17, 74953)
+    assert count_log_entries(populated_db) == (1, 0)
+
+    # Make sure we can't analyze a non-existing database
+    with pytest.raises(FileNotFoundError):
+        analyze_db(populated_db.parent / "non_existing.duckdb")
+
+
+def test_log(tmp_path: Path) -> None:
+    """Test writing to and reading from the log table."""
+    db_path = tmp_path / "test.duckdb"
+    create_db(db_path)
+
+    # Check that the database is empty
+    with duckdb.connect(db_path) as connection:
+        result = connection.sql("SELECT COUNT(*) FROM log").fetchall()
+        assert len(result) == 1
+        assert result[0][0] == 0
+
+    assert read_log_timestamps(db_path) == set()
+    assert read_log_timestamps(db_path, success=True) == set()
+    assert read_log_timestamps(db_path, success=False) == set()
+    assert count_log_entries(db_path) == (0, 0)
+
+    # Write to the log
+    update_log(db_path, datetime(2024, 1, 1), True)
+
+    with duckdb.connect(db_path) as connection:
+        result = connection.sql("SELECT timestamp FROM log").fetchall()
+        assert len(result) == 1
+        assert result[0][0] == datetime(2024, 1, 1)
+
+    assert read_log_timestamps(db_path) == {datetime(2024, 1, 1)}
+    assert read_log_timestamps(db_path, success=True) == {datetime(2024, 1, 1)}
+    assert read_log_timestamps(db_path, success=False) == set()
+    assert count_log_entries(db_path) == (1, 0)
+
+    # Make sure failures in recent files are not logged, as they are
+    # assumed to be unavailable from the mirror at check time rather
+    # than permanent errors.
+    update_log(db_path, datetime.now(), False)
+
+    assert read_log_timestamps(db_path) == {datetime(2024, 1, 1)}
+    assert read_log_timestamps(db_path, success=True) == {datetime(2024, 1, 1)}
+    assert read_log_timestamps(db_path, success=False) == set()
+
+    # Make sure we can't read from or write to a non-existing database
+    with pytest.raises(FileNotFoundError):
+        read_log_timestamps(tmp_path / "non_existing.duckdb")
+
+    with pytest.raises(FileNotFoundError):
+        count_log_entries(tmp_path / "non_existing.duckdb")
+
+    with pytest.raises(FileNotFoundError):
+        update_log(
+            tmp_path / "non_existing.duckdb",
+            datetime(2024, 1, 1),
+            True,
+        )
+
+
+def test_pending_timestamps(tmp_path: Path) -> None:
+    """Test filtering out timestamps which are already in the log."""
+    db_path = tmp_path / "test.duckdb"
+    create_db(db_path)
+
+    candidates = [datetime(2024, 1, 1, hour) for hour in (5, 2, 1, 3)]
+
+    # Nothing is logged, so everything is pending
+    assert pending_timestamps(db_path, candidates) == candidates
+    assert pending_timestamps(db_path, []) == []
+
+    # Logged timestamps are removed, and the order is kept
+    update_log(db_path, datetime(2024, 1, 1, 2), True)
+    update_log(db_path, datetime(2024, 1, 1, 3), False, "Error")
+
+    assert pending_timestamps(db_path, candidates) == [
+        datetime(2024, 1, 1, 5),
+        datetime(2024, 1, 1, 1),
+    ]
+
+    # Make sure we can't read from a non-existing database
+    with pytest.raises(FileNotFoundError):
+        pending_timestamps(tmp_path / "non_existing.duckdb", [])
@@ -0,0 +1,41 @@
+from pathlib import Path
+
+import pytest
+
+from pvduck.db import create_db
+from pvduck.project import _run_shell
+
+
+def test_run_shell(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    """Errors and Ctrl-C cancel the current statement, not the shell."""
+    db_path = tmp_path / "test.duckdb"
+    create_db(db_path)
+
+    # Errors raised while binding, while running, and Ctrl-C at the prompt
+    lines = iter(
+        [
+            "SELECT * FROM missing",
+            "SELECT 'a'::INT",
+            "SELECT error('boom')",
+            KeyboardInterrupt(),
+            "SELECT 42 AS answer",
+            EOFError(),
+        ]
+    )
+
+    def fake_input(prompt: str) -> str:
+        line = next(lines)
+        if isinstance(line, BaseException):
+            raise line
+        return line
+
+    monkeypatch.setattr("builtins.input", fake_input)
+    _run_shell(db_path)
+
+    out = capsys.readouterr().out.splitlines()
+    assert len([line for line in out if line.startswith("Error:")]) == 3
+    assert any("answer" in line for line in out)
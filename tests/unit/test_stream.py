@@ -1,38 +1,77 @@
+from collections.abc import Generator
 from pathlib import Path
 
 import duckdb
+import pytest
 
-from pvduck.stream import parquet_from_file
+from pvduck.stream import HTTP_STATUS_RE, parquet_from_file
 
+FILES = Path(__file__).parent.parent / "files"
+SAMPLE = FILES / "pageviews-20240803-060000.gz"
 
-def test_parquet_from_file() -> None:
-    """Make sure we can stream from a local file."""
-    path = (
-        Path(__file__).parent.parent / "files" / "pageviews-20240803-060000.gz"
-    )
 
-    with parquet_from_file(path) as parquet:
-        # Make sure the file is created
-        assert parquet.is_file()
-        assert parquet.name == "pageviews-20240803-060000.parquet"
-        assert parquet.stat().st_size > 0
+@pytest.fixture(scope="module")
+def sample_parquet() -> Generator[Path, None, None]:
+    """Convert the sample dump file once, and share the parquet file between
+    the tests in this module."""
+    with parquet_from_file(SAMPLE) as parquet:
+        yield parquet
 
-        # Make sure we can read information correctly from the file
-        with duckdb.connect() as connection:
-            result = connection.sql(f"SELECT COUNT(*) FROM '{str(parquet)}'")
-            row = result.fetchone()
-            assert row is not None
-            assert row[0] == 1000
 
-            result = connection.sql(
-                f"SELECT page_title FROM '{str(parquet)}' LIMIT 1"
-            )
-            row = result.fetchone()
-            assert row is not None
-            assert row[0] == "circumfluebant"
+def test_parquet_from_file(sample_parquet: Path) -> None:
+    """Make sure we can stream from a local file."""
+    # Make sure the file is created
+    assert sample_parquet.is_file()
+    assert sample_parquet.name == "pageviews-20240803-060000.parquet"
+    assert sample_parquet.stat().st_size > 0
+
+    # Make sure we can read information correctly from the file
+    with duckdb.connect() as connection:
+        count, page_title = connection.execute(
+            """
+            SELECT
+                COUNT(*),
+                (SELECT page_title FROM read_parquet($1) LIMIT 1)
+            FROM read_parquet($1)
+            """,
+            [str(sample_parquet)],
+        ).fetchall()[0]
+        assert count == 1000
+        assert page_title == "circumfluebant"
 
 
 def test_parquet_from_url() -> None:
     """Because this involves downloading a file from a remote server, it will
     only be part of the integration test."""
     pass
+
+
+def test_parquet_from_file_tmp_dir(tmp_path: Path) -> None:
+    """Make sure the temporary parquet file is created in `tmp_dir`, and
+    removed when the context closes."""
+    with parquet_from_file(SAMPLE, tmp_dir=str(tmp_path)) as parquet:
+        assert parquet.is_file()
+        assert parquet.is_relative_to(tmp_path)
+
+    # The file and its directory are removed when the context closes
+    assert not parquet.exists()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_http_status_re() -> None:
+    """Make sure we can read the status code from `pvstream` errors."""
+    message = (
+        "HTTP status client error (429 Too Many Requests) for url "
+        "(https://dumps.wikimedia.org/other/pageviews/2024/2024-08/"
+        "pageviews-20240803-060000.gz)"
+    )
+    match = HTTP_STATUS_RE.search(message)
+    assert match is not None
+    assert match.group(1) == "429"
+
+    message = "HTTP status server error (503 Service Unavailable) for url"
+    match = HTTP_STATUS_RE.search(message)
+    assert match is not None
+    assert match.group(1) == "503"
+
+    assert HTTP_STATUS_RE.search("error decoding response body") is None
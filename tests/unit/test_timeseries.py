@@ -12,9 +12,9 @@ def test_basic() -> None:
     end_date = datetime(2024, 1, 2)
     result = timeseries(start_date, end_date)
 
-    assert len(result) == 25
-    assert all(isinstance(ts, datetime) for ts in result)
-    assert all(ts >= start_date and ts <= end_date for ts in result)
+    # Every hour in the range is included exactly once
+    hours = [start_date + timedelta(hours=hour) for hour in range(25)]
+    assert sorted(result) == hours
 
     unbounded = timeseries(datetime.now() - timedelta(days=1))
     assert max(unbounded) == datetime.now().replace(
@@ -67,7 +67,7 @@ def test_order() -> None:
     )
     assert chronological[0] == start_date
     assert chronological[-1] == end_date
-    assert chronological == sorted(chronological)
+    assert all(a < b for a, b in zip(chronological, chronological[1:]))
 
     # Reverse chronological order
     reverse_chronological = timeseries(
@@ -75,7 +75,7 @@ def test_order() -> None:
     )
     assert reverse_chronological[0] == end_date
     assert reverse_chronological[-1] == start_date
-    assert reverse_chronological == sorted(chronological, reverse=True)
+    assert reverse_chronological == chronological[::-1]
 
     # Random order
     random_order = timeseries(
@@ -83,9 +83,7 @@ def test_order() -> None:
     )
     assert random_order != chronological
     assert random_order != reverse_chronological
-    assert (
-        set(random_order) == set(chronological) == set(reverse_chronological)
-    )
+    assert sorted(random_order) == chronological
 
 
 def test_seed() -> None:
@@ -99,8 +97,7 @@ def test_seed() -> None:
 
     # All time series should have the same elements, but in different orders
     # based on the seed.
-    assert len(ts1) == len(ts2) == len(ts3)
-    assert set(ts1) == set(ts2) == set(ts3)
+    assert sorted(ts1) == sorted(ts2)
 
     assert ts1 == ts3
     assert ts2 != ts1
@@ -139,8 +136,8 @@ def test_expansions() -> None:
     assert len(ts_initial) < len(ts_expanded)
     assert ts_initial == ts_expanded[: len(ts_initial)]
 
-    # With sampling, the expanded time series should be a superset of the
-    # initial time series, even with random ordering.
+    # With sampling, the expanded time series should contain the initial
+    # time series, in the same order, even with random ordering.
     ts_initial = timeseries(
         start_date,
         end_date,
@@ -152,4 +149,48 @@ def test_expansions() -> None:
         sample_rate=0.5,
     )
     assert len(ts_initial) < len(ts_expanded)
-    assert set(ts_initial).issubset(set(ts_expanded))
+    assert [ts for ts in ts_expanded if ts <= end_date] == ts_initial
+
+
+def test_stable_ranking() -> None:
+    """The ranking must never change for existing projects, as that would
+    change which timestamps are sampled. Pin the start of a known series."""
+    result = timeseries(datetime(2024, 1, 1), datetime(2024, 1, 3), 0.5)
+
+    assert result[:6] == [
+        datetime(2024, 1, 1, 7),
+        datetime(2024, 1, 2, 17),
+        datetime(2024, 1, 2, 7),
+        datetime(2024, 1, 2, 1),
+        datetime(2024, 1, 2, 16),
+        datetime(2024, 1, 2, 10),
+    ]
+
+    result = timeseries(
+        datetime(2024, 1, 1), datetime(2024, 1, 3), 0.5, score_version=2
+    )
+
+    assert result[:6] == [
+        datetime(2024, 1, 2, 18),
+        datetime(2024, 1, 2, 22),
+        datetime(2024, 1, 2, 17),
+        datetime(2024, 1, 3, 0),
+        datetime(2024, 1, 2, 13),
+        datetime(2024, 1, 2, 2),
+    ]
+
+
+def test_score_versions() -> None:
+    """Score versions sample the same way, but rank timestamps differently."""
+    start_date = datetime(2024, 1, 1)
+    end_date = datetime(2024, 1, 2)
+
+    v1 = timeseries(start_date, end_date, score_version=1)
+    v2 = timeseries(start_date, end_date, score_version=2)
+
+    assert set(v1) == set(v2)
+    assert v1 != v2
+    assert v2 == timeseries(start_date, end_date, score_version=2)
+
+    with pytest.raises(ValueError):
+        timeseries(start_date, end_date, score_version=3)
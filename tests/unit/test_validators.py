@@ -1,25 +1,66 @@
 from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Callable, Optional
 
 import pytest
 
-from pvduck.validators import mandatory_datetime, optional_datetime
+from pvduck.validators import (
+    mandatory_datetime,
+    optional_datetime,
+    writable_directory,
+)
 
+# Both validators accept dates and datetimes, and reject date strings
+VALIDATORS = [mandatory_datetime, optional_datetime]
+VALID = [
+    (date(2024, 9, 1), datetime(2024, 9, 1)),
+    (datetime(2024, 9, 1), datetime(2024, 9, 1)),
+    (datetime(2024, 9, 1, 12, 30), datetime(2024, 9, 1)),
+]
 
-def test_mandatory_datetime():
-    """Test mandatory_datetime function."""
-    assert mandatory_datetime(date(2024, 9, 1)) == datetime(2024, 9, 1)
-    assert mandatory_datetime(datetime(2024, 9, 1)) == datetime(2024, 9, 1)
+
+@pytest.mark.parametrize("validator", VALIDATORS)
+@pytest.mark.parametrize("input, expected", VALID)
+def test_valid_datetime(
+    validator: Callable[[Any], Optional[datetime]],
+    input: Any,
+    expected: datetime,
+) -> None:
+    """Dates and datetimes are converted to datetimes at midnight."""
+    assert validator(input) == expected
+
+
+@pytest.mark.parametrize("validator", VALIDATORS)
+def test_invalid_datetime(
+    validator: Callable[[Any], Optional[datetime]],
+) -> None:
+    """Date strings are not parsed."""
     with pytest.raises(ValueError):
-        mandatory_datetime("2024-09-01")
+        validator("2024-09-01")
+
+
+def test_mandatory_datetime() -> None:
+    """Test mandatory_datetime function."""
     with pytest.raises(ValueError):
         mandatory_datetime(None)
 
 
-def test_optional_datetime():
+def test_optional_datetime() -> None:
     """Test optional_datetime function."""
-    assert optional_datetime(date(2024, 9, 1)) == datetime(2024, 9, 1)
-    assert optional_datetime(datetime(2024, 9, 1)) == datetime(2024, 9, 1)
     assert optional_datetime("") is None
     assert optional_datetime(None) is None
+
+
+def test_writable_directory(tmp_path: Path) -> None:
+    """Test writable_directory function."""
+    assert writable_directory(None) is None
+    assert writable_directory(str(tmp_path)) == str(tmp_path)
+
+    with pytest.raises(ValueError):
+        writable_directory(str(tmp_path / "missing"))
+
+    # A file is not a directory
+    file = tmp_path / "file"
+    file.touch()
     with pytest.raises(ValueError):
-        optional_datetime("2024-09-01")
+        writable_directory(str(file))